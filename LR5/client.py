@@ -57,6 +57,20 @@ class GlossaryClient:
         except grpc.RpcError as e:
             return f"Error: {e.details()}"
 
+    def related_terms(self, term, k=5):
+        try:
+            response = self.stub.RelatedTerms(glossary_pb2.RelatedTermsRequest(term=term, k=k))
+            return response
+        except grpc.RpcError as e:
+            return f"Error: {e.details()}"
+
+    def top_terms(self, k=10, source=''):
+        try:
+            response = self.stub.TopTerms(glossary_pb2.TopTermsRequest(k=k, source=source))
+            return response
+        except grpc.RpcError as e:
+            return f"Error: {e.details()}"
+
     def list_all_terms(self, page=1, page_size=10):
         try:
             response = self.stub.ListAllTerms(glossary_pb2.ListAllRequest(
@@ -78,7 +92,9 @@ def main():
         print("4. Update term")
         print("5. Delete term")
         print("6. List all terms")
-        print("7. Exit")
+        print("7. Related terms")
+        print("8. Top terms")
+        print("9. Exit")
 
         choice = input("Choose option: ")
 
@@ -143,6 +159,27 @@ def main():
                 print(result)
 
         elif choice == '7':
+            term = input("Enter term: ")
+            k = int(input("How many (default 5): ") or 5)
+            result = client.related_terms(term, k)
+            if hasattr(result, 'terms'):
+                print(f"\nTerms related to {term}:")
+                for related in result.terms:
+                    print(f"- {related.term.term} ({related.score:.2f}): {related.term.definition[:50]}...")
+            else:
+                print(result)
+
+        elif choice == '8':
+            source = input("Source - get or search (default get): ")
+            result = client.top_terms(10, source)
+            if hasattr(result, 'terms'):
+                print(f"\nTop terms of {result.total} requests:")
+                for top in result.terms:
+                    print(f"- {top.key}: {top.count} (+/-{top.error})")
+            else:
+                print(result)
+
+        elif choice == '9':
             break
 
 
@@ -14,7 +14,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0eglossary.proto\x12\x08glossary\"\x1e\n\x0eGetTermRequest\x12\x0c\n\x04term\x18\x01 \x01(\t\"#\n\x12SearchTermsRequest\x12\r\n\x05query\x18\x01 \x01(\t\"V\n\x0e\x41\x64\x64TermRequest\x12\x0c\n\x04term\x18\x01 \x01(\t\x12\x12\n\ndefinition\x18\x02 \x01(\t\x12\x10\n\x08\x63\x61tegory\x18\x03 \x01(\t\x12\x10\n\x08\x65xamples\x18\x04 \x03(\t\"Y\n\x11UpdateTermRequest\x12\x0c\n\x04term\x18\x01 \x01(\t\x12\x12\n\ndefinition\x18\x02 \x01(\t\x12\x10\n\x08\x63\x61tegory\x18\x03 \x01(\t\x12\x10\n\x08\x65xamples\x18\x04 \x03(\t\"!\n\x11\x44\x65leteTermRequest\x12\x0c\n\x04term\x18\x01 \x01(\t\"1\n\x0eListAllRequest\x12\x0c\n\x04page\x18\x01 \x01(\x05\x12\x11\n\tpage_size\x18\x02 \x01(\x05\"|\n\x0cTermResponse\x12\x0c\n\x04term\x18\x01 \x01(\t\x12\x12\n\ndefinition\x18\x02 \x01(\t\x12\x10\n\x08\x63\x61tegory\x18\x03 \x01(\t\x12\x10\n\x08\x65xamples\x18\x04 \x03(\t\x12\x12\n\ncreated_at\x18\x05 \x01(\t\x12\x12\n\nupdated_at\x18\x06 \x01(\t\"Q\n\x13SearchTermsResponse\x12%\n\x05terms\x18\x01 \x03(\x0b\x32\x16.glossary.TermResponse\x12\x13\n\x0btotal_count\x18\x02 \x01(\x05\"n\n\x0fListAllResponse\x12%\n\x05terms\x18\x01 \x03(\x0b\x32\x16.glossary.TermResponse\x12\x13\n\x0btotal_count\x18\x02 \x01(\x05\x12\x0c\n\x04page\x18\x03 \x01(\x05\x12\x11\n\tpage_size\x18\x04 \x01(\x05\"5\n\x11OperationResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t2\xb1\x03\n\x0fGlossaryService\x12;\n\x07GetTerm\x12\x18.glossary.GetTermRequest\x1a\x16.glossary.TermResponse\x12J\n\x0bSearchTerms\x12\x1c.glossary.SearchTermsRequest\x1a\x1d.glossary.SearchTermsResponse\x12@\n\x07\x41\x64\x64Term\x12\x18.glossary.AddTermRequest\x1a\x1b.glossary.OperationResponse\x12\x46\n\nUpdateTerm\x12\x1b.glossary.UpdateTermRequest\x1a\x1b.glossary.OperationResponse\x12\x46\n\nDeleteTerm\x12\x1b.glossary.DeleteTermRequest\x1a\x1b.glossary.OperationResponse\x12\x43\n\x0cListAllTerms\x12\x18.glossary.ListAllRequest\x1a\x19.glossary.ListAllResponseb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0eglossary.proto\x12\x08glossary\"\x1e\n\x0eGetTermRequest\x12\x0c\n\x04term\x18\x01 \x01(\t\"#\n\x12SearchTermsRequest\x12\r\n\x05query\x18\x01 \x01(\t\"V\n\x0e\x41\x64\x64TermRequest\x12\x0c\n\x04term\x18\x01 \x01(\t\x12\x12\n\ndefinition\x18\x02 \x01(\t\x12\x10\n\x08\x63\x61tegory\x18\x03 \x01(\t\x12\x10\n\x08\x65xamples\x18\x04 \x03(\t\"Y\n\x11UpdateTermRequest\x12\x0c\n\x04term\x18\x01 \x01(\t\x12\x12\n\ndefinition\x18\x02 \x01(\t\x12\x10\n\x08\x63\x61tegory\x18\x03 \x01(\t\x12\x10\n\x08\x65xamples\x18\x04 \x03(\t\"!\n\x11\x44\x65leteTermRequest\x12\x0c\n\x04term\x18\x01 \x01(\t\".\n\x13RelatedTermsRequest\x12\x0c\n\x04term\x18\x01 \x01(\t\x12\t\n\x01k\x18\x02 \x01(\x05\",\n\x0fTopTermsRequest\x12\t\n\x01k\x18\x01 \x01(\x05\x12\x0e\n\x06source\x18\x02 \x01(\t\"L\n\x0eProfileRequest\x12\x0f\n\x07seconds\x18\x01 \x01(\x01\x12\x10\n\x08interval\x18\x02 \x01(\x01\x12\x17\n\x0ftop_allocations\x18\x03 \x01(\x05\"1\n\x0eListAllRequest\x12\x0c\n\x04page\x18\x01 \x01(\x05\x12\x11\n\tpage_size\x18\x02 \x01(\x05\"|\n\x0cTermResponse\x12\x0c\n\x04term\x18\x01 \x01(\t\x12\x12\n\ndefinition\x18\x02 \x01(\t\x12\x10\n\x08\x63\x61tegory\x18\x03 \x01(\t\x12\x10\n\x08\x65xamples\x18\x04 \x03(\t\x12\x12\n\ncreated_at\x18\x05 \x01(\t\x12\x12\n\nupdated_at\x18\x06 \x01(\t\"Q\n\x13SearchTermsResponse\x12%\n\x05terms\x18\x01 \x03(\x0b\x32\x16.glossary.TermResponse\x12\x13\n\x0btotal_count\x18\x02 \x01(\x05\"n\n\x0fListAllResponse\x12%\n\x05terms\x18\x01 \x03(\x0b\x32\x16.glossary.TermResponse\x12\x13\n\x0btotal_count\x18\x02 \x01(\x05\x12\x0c\n\x04page\x18\x03 \x01(\x05\x12\x11\n\tpage_size\x18\x04 \x01(\x05\"B\n\x0bRelatedTerm\x12$\n\x04term\x18\x01 \x01(\x0b\x32\x16.glossary.TermResponse\x12\r\n\x05score\x18\x02 \x01(\x01\"<\n\x14RelatedTermsResponse\x12$\n\x05terms\x18\x01 \x03(\x0b\x32\x15.glossary.RelatedTerm\"4\n\x07TopTerm\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05\x63ount\x18\x02 \x01(\x03\x12\r\n\x05\x65rror\x18\x03 \x01(\x03\"C\n\x10TopTermsResponse\x12 \n\x05terms\x18\x01 \x03(\x0b\x32\x11.glossary.TopTerm\x12\r\n\x05total\x18\x02 \x01(\x03\";\n\nAllocation\x12\x10\n\x08location\x18\x01 \x01(\t\x12\x0c\n\x04size\x18\x02 \x01(\x03\x12\r\n\x05\x63ount\x18\x03 \x01(\x03\"`\n\x0fProfileResponse\x12\x11\n\tcollapsed\x18\x01 \x01(\t\x12\x0f\n\x07samples\x18\x02 \x01(\x05\x12)\n\x0b\x61llocations\x18\x03 \x03(\x0b\x32\x14.glossary.Allocation\"5\n\x11OperationResponse\x12\x0f\n\x07success\x18\x01 \x01(\x08\x12\x0f\n\x07message\x18\x02 \x01(\t2\x83\x05\n\x0fGlossaryService\x12;\n\x07GetTerm\x12\x18.glossary.GetTermRequest\x1a\x16.glossary.TermResponse\x12J\n\x0bSearchTerms\x12\x1c.glossary.SearchTermsRequest\x1a\x1d.glossary.SearchTermsResponse\x12@\n\x07\x41\x64\x64Term\x12\x18.glossary.AddTermRequest\x1a\x1b.glossary.OperationResponse\x12\x46\n\nUpdateTerm\x12\x1b.glossary.UpdateTermRequest\x1a\x1b.glossary.OperationResponse\x12\x46\n\nDeleteTerm\x12\x1b.glossary.DeleteTermRequest\x1a\x1b.glossary.OperationResponse\x12\x43\n\x0cListAllTerms\x12\x18.glossary.ListAllRequest\x1a\x19.glossary.ListAllResponse\x12M\n\x0cRelatedTerms\x12\x1d.glossary.RelatedTermsRequest\x1a\x1e.glossary.RelatedTermsResponse\x12\x41\n\x08TopTerms\x12\x19.glossary.TopTermsRequest\x1a\x1a.glossary.TopTermsResponse\x12>\n\x07Profile\x12\x18.glossary.ProfileRequest\x1a\x19.glossary.ProfileResponseb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -31,16 +31,34 @@ if _descriptor._USE_C_DESCRIPTORS == False:
   _globals['_UPDATETERMREQUEST']._serialized_end=274
   _globals['_DELETETERMREQUEST']._serialized_start=276
   _globals['_DELETETERMREQUEST']._serialized_end=309
-  _globals['_LISTALLREQUEST']._serialized_start=311
-  _globals['_LISTALLREQUEST']._serialized_end=360
-  _globals['_TERMRESPONSE']._serialized_start=362
-  _globals['_TERMRESPONSE']._serialized_end=486
-  _globals['_SEARCHTERMSRESPONSE']._serialized_start=488
-  _globals['_SEARCHTERMSRESPONSE']._serialized_end=569
-  _globals['_LISTALLRESPONSE']._serialized_start=571
-  _globals['_LISTALLRESPONSE']._serialized_end=681
-  _globals['_OPERATIONRESPONSE']._serialized_start=683
-  _globals['_OPERATIONRESPONSE']._serialized_end=736
-  _globals['_GLOSSARYSERVICE']._serialized_start=739
-  _globals['_GLOSSARYSERVICE']._serialized_end=1172
+  _globals['_RELATEDTERMSREQUEST']._serialized_start=311
+  _globals['_RELATEDTERMSREQUEST']._serialized_end=357
+  _globals['_TOPTERMSREQUEST']._serialized_start=359
+  _globals['_TOPTERMSREQUEST']._serialized_end=403
+  _globals['_PROFILEREQUEST']._serialized_start=405
+  _globals['_PROFILEREQUEST']._serialized_end=481
+  _globals['_LISTALLREQUEST']._serialized_start=483
+  _globals['_LISTALLREQUEST']._serialized_end=532
+  _globals['_TERMRESPONSE']._serialized_start=534
+  _globals['_TERMRESPONSE']._serialized_end=658
+  _globals['_SEARCHTERMSRESPONSE']._serialized_start=660
+  _globals['_SEARCHTERMSRESPONSE']._serialized_end=741
+  _globals['_LISTALLRESPONSE']._serialized_start=743
+  _globals['_LISTALLRESPONSE']._serialized_end=853
+  _globals['_RELATEDTERM']._serialized_start=855
+  _globals['_RELATEDTERM']._serialized_end=921
+  _globals['_RELATEDTERMSRESPONSE']._serialized_start=923
+  _globals['_RELATEDTERMSRESPONSE']._serialized_end=983
+  _globals['_TOPTERM']._serialized_start=985
+  _globals['_TOPTERM']._serialized_end=1037
+  _globals['_TOPTERMSRESPONSE']._serialized_start=1039
+  _globals['_TOPTERMSRESPONSE']._serialized_end=1106
+  _globals['_ALLOCATION']._serialized_start=1108
+  _globals['_ALLOCATION']._serialized_end=1167
+  _globals['_PROFILERESPONSE']._serialized_start=1169
+  _globals['_PROFILERESPONSE']._serialized_end=1265
+  _globals['_OPERATIONRESPONSE']._serialized_start=1267
+  _globals['_OPERATIONRESPONSE']._serialized_end=1320
+  _globals['_GLOSSARYSERVICE']._serialized_start=1323
+  _globals['_GLOSSARYSERVICE']._serialized_end=1966
 # @@protoc_insertion_point(module_scope)
@@ -44,6 +44,21 @@ class GlossaryServiceStub(object):
                 request_serializer=glossary__pb2.ListAllRequest.SerializeToString,
                 response_deserializer=glossary__pb2.ListAllResponse.FromString,
                 )
+        self.RelatedTerms = channel.unary_unary(
+                '/glossary.GlossaryService/RelatedTerms',
+                request_serializer=glossary__pb2.RelatedTermsRequest.SerializeToString,
+                response_deserializer=glossary__pb2.RelatedTermsResponse.FromString,
+                )
+        self.TopTerms = channel.unary_unary(
+                '/glossary.GlossaryService/TopTerms',
+                request_serializer=glossary__pb2.TopTermsRequest.SerializeToString,
+                response_deserializer=glossary__pb2.TopTermsResponse.FromString,
+                )
+        self.Profile = channel.unary_unary(
+                '/glossary.GlossaryService/Profile',
+                request_serializer=glossary__pb2.ProfileRequest.SerializeToString,
+                response_deserializer=glossary__pb2.ProfileResponse.FromString,
+                )
 
 
 class GlossaryServiceServicer(object):
@@ -85,6 +100,25 @@ class GlossaryServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def RelatedTerms(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def TopTerms(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Profile(self, request, context):
+        """Только для администратора: токен в метаданных x-admin-token
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_GlossaryServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -118,6 +152,21 @@ def add_GlossaryServiceServicer_to_server(servicer, server):
                     request_deserializer=glossary__pb2.ListAllRequest.FromString,
                     response_serializer=glossary__pb2.ListAllResponse.SerializeToString,
             ),
+            'RelatedTerms': grpc.unary_unary_rpc_method_handler(
+                    servicer.RelatedTerms,
+                    request_deserializer=glossary__pb2.RelatedTermsRequest.FromString,
+                    response_serializer=glossary__pb2.RelatedTermsResponse.SerializeToString,
+            ),
+            'TopTerms': grpc.unary_unary_rpc_method_handler(
+                    servicer.TopTerms,
+                    request_deserializer=glossary__pb2.TopTermsRequest.FromString,
+                    response_serializer=glossary__pb2.TopTermsResponse.SerializeToString,
+            ),
+            'Profile': grpc.unary_unary_rpc_method_handler(
+                    servicer.Profile,
+                    request_deserializer=glossary__pb2.ProfileRequest.FromString,
+                    response_serializer=glossary__pb2.ProfileResponse.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'glossary.GlossaryService', rpc_method_handlers)
@@ -229,3 +278,54 @@ class GlossaryService(object):
             glossary__pb2.ListAllResponse.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def RelatedTerms(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/glossary.GlossaryService/RelatedTerms',
+            glossary__pb2.RelatedTermsRequest.SerializeToString,
+            glossary__pb2.RelatedTermsResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def TopTerms(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/glossary.GlossaryService/TopTerms',
+            glossary__pb2.TopTermsRequest.SerializeToString,
+            glossary__pb2.TopTermsResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def Profile(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/glossary.GlossaryService/Profile',
+            glossary__pb2.ProfileRequest.SerializeToString,
+            glossary__pb2.ProfileResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
@@ -0,0 +1,86 @@
+import threading
+
+
+class SpaceSaving:
+    """Top-K самых частых ключей потока в памяти O(capacity) (Space-Saving).
+
+    Отслеживается не больше capacity ключей. Новый ключ при заполненной
+    таблице вытесняет ключ с наименьшим счётчиком и наследует его значение
+    как погрешность: count завышен не больше чем на error, а любой ключ с
+    частотой больше N / capacity гарантированно есть в таблице.
+    Ключи сгруппированы по значению счётчика (Stream-Summary), поэтому
+    учёт и вытеснение - O(1)."""
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        # key -> [count, error]
+        self.counters = {}
+        # count -> ключи с таким счётчиком (dict как упорядоченное множество)
+        self.buckets = {}
+        self.min_count = 0
+        self.total = 0
+
+    def _discard(self, key, count, replacement):
+        """Убираем key из корзины count; replacement - новый счётчик на его месте"""
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+            if count == self.min_count:
+                # Счётчики целые: count + 1 точно минимальный, если он есть
+                self.min_count = replacement if replacement == count + 1 else min(self.buckets, default=0)
+
+    def _insert(self, key, count):
+        self.buckets.setdefault(count, {})[key] = None
+        if not self.min_count or count < self.min_count:
+            self.min_count = count
+
+    def add(self, key, count=1, error=0):
+        """Учитываем count обращений к key. Возвращает вытесненный ключ или None"""
+        with self.lock:
+            self.total += count
+            entry = self.counters.get(key)
+            if entry is not None:
+                old = entry[0]
+                entry[0] += count
+                self._insert(key, entry[0])
+                self._discard(key, old, entry[0])
+                return None
+
+            evicted = None
+            if len(self.counters) >= self.capacity:
+                # Старейший из ключей с наименьшим счётчиком; его счётчик
+                # добавляется и к count, и к погрешности
+                floor = self.min_count
+                evicted = next(iter(self.buckets[floor]))
+                del self.counters[evicted]
+                count += floor
+                error += floor
+                self._insert(key, count)
+                self._discard(evicted, floor, count)
+            else:
+                self._insert(key, count)
+            self.counters[key] = [count, error]
+            return evicted
+
+    def __contains__(self, key):
+        return key in self.counters
+
+    def top(self, k):
+        """[(key, count, error)] по убыванию count"""
+        with self.lock:
+            entries = [(key, count, error) for key, (count, error) in self.counters.items()]
+        entries.sort(key=lambda entry: entry[1], reverse=True)
+        return entries[:k]
+
+    def dump(self):
+        return self.top(self.capacity)
+
+    def load(self, entries):
+        """Восстановление из dump(). Если сохранено больше capacity ключей,
+        берутся самые частые: вытеснение при загрузке только добавило бы
+        погрешности"""
+        entries = sorted(entries, key=lambda entry: entry[1], reverse=True)
+        for key, count, error in entries[:self.capacity]:
+            self.add(key, count, error)
@@ -0,0 +1,104 @@
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# Ограничения на один запуск профилировщика
+MAX_SECONDS = 60
+MIN_INTERVAL = 0.001
+
+
+class ProfilerBusy(Exception):
+    """Профилировщик уже запущен другим запросом"""
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class SamplingProfiler:
+    """Сэмплирующий профилировщик всех потоков процесса по запросу.
+
+    Пока не запущен, ничего не стоит: нет ни хуков, ни фонового потока.
+    На время run() вызывающий поток каждые interval секунд снимает стеки
+    всех остальных потоков через sys._current_frames() (gRPC-обработчики,
+    потоки Flask), а tracemalloc записывает выделения памяти за это же окно.
+    Результат - свёрнутые стеки для flamegraph.pl/speedscope
+    ("поток;внешняя;...;внутренняя число") и топ мест выделения памяти."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def run(self, seconds, interval=0.005, top_allocations=20):
+        """ValueError, если seconds или interval не положительные конечные числа"""
+        if not (math.isfinite(seconds) and seconds > 0):
+            raise ValueError("seconds must be a positive number")
+        if not (math.isfinite(interval) and interval > 0):
+            raise ValueError("interval must be a positive number")
+        if top_allocations < 0:
+            raise ValueError("top must be non-negative")
+        seconds = min(seconds, MAX_SECONDS)
+        interval = max(interval, MIN_INTERVAL)
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("profiler is already running")
+        try:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            try:
+                stacks, samples = self._sample(seconds, interval)
+                snapshot = tracemalloc.take_snapshot()
+            finally:
+                if started_tracing:
+                    tracemalloc.stop()
+        finally:
+            self._lock.release()
+
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+        allocations = [
+            {
+                'location': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                'size': stat.size,
+                'count': stat.count,
+            }
+            for stat in snapshot.statistics('lineno')[:top_allocations]
+        ]
+        collapsed = '\n'.join(f"{stack} {count}" for stack, count in stacks.most_common())
+        return {
+            'seconds': seconds,
+            'samples': samples,
+            'collapsed': collapsed,
+            'allocations': allocations,
+        }
+
+    def _sample(self, seconds, interval):
+        stacks = Counter()
+        samples = 0
+        own = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        names = {}
+        while True:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    # Имена перечитываем только для новых потоков
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}"))
+                stacks[';'.join(reversed(labels))] += 1
+            samples += 1
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(interval)
+        return stacks, samples
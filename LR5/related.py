@@ -0,0 +1,137 @@
+import math
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+# Слова из букв/цифр/подчёркиваний длиной от двух символов (в т.ч. кириллица)
+TOKEN = re.compile(r'\w{2,}')
+# Сколько ближайших соседей на термин считается заранее одним пакетом
+PRECOMPUTED_K = 10
+# Размер пакета строк при пакетном подсчёте сходства (ограничивает память)
+BATCH_ROWS = 256
+
+
+def term_tokens(term_data):
+    """Частоты слов определения, категории и примеров"""
+    text = ' '.join([term_data['definition'], term_data['category'], *term_data['examples']])
+    return Counter(TOKEN.findall(text.lower()))
+
+
+class RelatedIndex:
+    """Неизменяемый TF-IDF индекс словаря для поиска похожих терминов.
+
+    tf - разреженная CSR-матрица (термин x слово) с сублинейной частотой
+    1 + log(tf), df - число терминов с каждым словом. Нормированная по
+    строкам матрица TF-IDF даёт косинусное сходство скалярным произведением.
+    При изменении словаря updated() строит новый индекс: заново разбираются
+    только изменённые термины, строки остальных и df переиспользуются."""
+
+    def __init__(self, keys, tf, df, vocabulary):
+        self.keys = keys
+        self.rows = {key: i for i, key in enumerate(keys)}
+        self.tf = tf
+        self.df = df
+        # Слово -> столбец. Словарь только растёт и общий для всех версий
+        # индекса: старые версии просто не видят новых столбцов
+        self.vocabulary = vocabulary
+        self.matrix = self._tfidf()
+        self._neighbours = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def empty(cls):
+        return cls([], sparse.csr_matrix((0, 0)), np.zeros(0, dtype=np.int64), {})
+
+    def _tfidf(self):
+        n = len(self.keys)
+        if n == 0:
+            return self.tf
+        idf = np.log((1 + n) / (1 + self.df)) + 1
+        matrix = sparse.csr_matrix(self.tf.multiply(idf))
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+
+    def _tf_rows(self, term_list):
+        """CSR-строки сублинейных частот для терминов; дополняет словарь"""
+        data, indices, indptr = [], [], [0]
+        for term_data in term_list:
+            for token, count in term_tokens(term_data).items():
+                column = self.vocabulary.setdefault(token, len(self.vocabulary))
+                indices.append(column)
+                data.append(1 + math.log(count))
+            indptr.append(len(indices))
+        return data, indices, indptr
+
+    def updated(self, terms, added, changed, removed):
+        """Новый индекс после изменения словаря (terms - уже новый словарь)"""
+        dropped = set(changed) | set(removed)
+        keep = [i for i, key in enumerate(self.keys) if key not in dropped]
+        fresh = list(added) + list(changed)
+
+        data, indices, indptr = self._tf_rows([terms[key] for key in fresh])
+        width = len(self.vocabulary)
+
+        old = self.tf
+        # Старые строки в новую ширину: данные те же, меняется только shape
+        old = sparse.csr_matrix((old.data, old.indices, old.indptr), shape=(old.shape[0], width))
+        new = sparse.csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.int32),
+                                 np.array(indptr, dtype=np.int32)), shape=(len(fresh), width))
+
+        df = np.zeros(width, dtype=np.int64)
+        df[:len(self.df)] = self.df
+        dropped_rows = [self.rows[key] for key in dropped if key in self.rows]
+        if dropped_rows:
+            df -= np.bincount(old[dropped_rows].indices, minlength=width)
+        df += np.bincount(new.indices, minlength=width)
+
+        tf = sparse.vstack([old[keep], new], format='csr')
+        return RelatedIndex([self.keys[i] for i in keep] + fresh, tf, df, self.vocabulary)
+
+    def _precomputed(self):
+        """Пакетный top-K для всех терминов: (индексы, сходства), по убыванию"""
+        if self._neighbours is None:
+            with self._lock:
+                if self._neighbours is None:
+                    self._neighbours = self._top_k(range(len(self.keys)), PRECOMPUTED_K)
+        return self._neighbours
+
+    def warm(self):
+        """Считаем соседей заранее, а не на первом запросе"""
+        self._precomputed()
+
+    def _top_k(self, rows, k):
+        rows = np.asarray(rows, dtype=np.int64)
+        k = min(k, max(len(self.keys) - 1, 0))
+        indices = np.zeros((len(rows), k), dtype=np.int64)
+        scores = np.zeros((len(rows), k))
+        if k == 0:
+            return indices, scores
+        transposed = self.matrix.T.tocsc()
+        for start in range(0, len(rows), BATCH_ROWS):
+            batch = rows[start:start + BATCH_ROWS]
+            similarity = (self.matrix[batch] @ transposed).toarray()
+            # Сам термин себе не сосед
+            similarity[np.arange(len(batch)), batch] = -1
+            top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(similarity, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            indices[start:start + len(batch)] = np.take_along_axis(top, order, axis=1)
+            scores[start:start + len(batch)] = np.take_along_axis(top_scores, order, axis=1)
+        return indices, scores
+
+    def related(self, key, k):
+        """До k пар (ключ термина, сходство) с ненулевым сходством"""
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        if k <= PRECOMPUTED_K:
+            indices, scores = self._precomputed()
+            indices, scores = indices[row], scores[row]
+        else:
+            indices, scores = self._top_k([row], k)
+            indices, scores = indices[0], scores[0]
+        return [(self.keys[i], float(s)) for i, s in zip(indices[:k], scores[:k]) if s > 0]
@@ -1,116 +1,24 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
+import atexit
+import signal
 import threading
-import time
 import grpc
 from concurrent import futures
 
 # Импортируем наши gRPC модули
 import glossary_pb2
 import glossary_pb2_grpc
-import json
-import os
+from profiler import ProfilerBusy
+from server import GlossaryService as BaseGlossaryService, HOT_TERMS_CAPACITY, RELATED_MAX_K, is_admin, profiler
 
 app = Flask(__name__)
 CORS(app)
 
 
-class GlossaryService(glossary_pb2_grpc.GlossaryServiceServicer):
-    def __init__(self):
-        self.data_file = 'glossary_data.json'
-        self.load_data()
-
-    def load_data(self):
-        if os.path.exists(self.data_file):
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                self.glossary = json.load(f)
-        else:
-            self.glossary = {
-                "list": {
-                    "term": "list",
-                    "definition": "Встроенный тип данных в Python, представляющий упорядоченную изменяемую коллекцию элементов",
-                    "category": "Data Structures",
-                    "examples": ["my_list = [1, 2, 3]", "my_list.append(4)"],
-                    "created_at": "2024-01-01 10:00:00",
-                    "updated_at": "2024-01-01 10:00:00"
-                },
-                "dictionary": {
-                    "term": "dictionary",
-                    "definition": "Встроенный тип данных в Python, представляющий неупорядоченную коллекцию пар ключ-значение",
-                    "category": "Data Structures",
-                    "examples": ["my_dict = {'key': 'value'}", "value = my_dict['key']"],
-                    "created_at": "2024-01-01 10:00:00",
-                    "updated_at": "2024-01-01 10:00:00"
-                }
-            }
-            self.save_data()
-
-    def save_data(self):
-        with open(self.data_file, 'w', encoding='utf-8') as f:
-            json.dump(self.glossary, f, ensure_ascii=False, indent=2)
-
-    def GetTerm(self, request, context):
-        term_key = request.term.lower()
-        if term_key in self.glossary:
-            term_data = self.glossary[term_key]
-            return glossary_pb2.TermResponse(
-                term=term_data['term'],
-                definition=term_data['definition'],
-                category=term_data['category'],
-                examples=term_data['examples'],
-                created_at=term_data['created_at'],
-                updated_at=term_data['updated_at']
-            )
-        else:
-            context.set_code(grpc.StatusCode.NOT_FOUND)
-            context.set_details(f"Term '{request.term}' not found")
-            return glossary_pb2.TermResponse()
-
-    def SearchTerms(self, request, context):
-        query = request.query.lower()
-        results = []
-
-        for term_key, term_data in self.glossary.items():
-            if (query in term_key or
-                    query in term_data['definition'].lower() or
-                    query in term_data['category'].lower()):
-                results.append(glossary_pb2.TermResponse(
-                    term=term_data['term'],
-                    definition=term_data['definition'],
-                    category=term_data['category'],
-                    examples=term_data['examples'],
-                    created_at=term_data['created_at'],
-                    updated_at=term_data['updated_at']
-                ))
-
-        return glossary_pb2.SearchTermsResponse(
-            terms=results,
-            total_count=len(results)
-        )
-
-    def AddTerm(self, request, context):
-        term_key = request.term.lower()
-        current_time = time.strftime("%Y-%m-%d %H:%M:%S")
-
-        if term_key in self.glossary:
-            context.set_code(grpc.StatusCode.ALREADY_EXISTS)
-            context.set_details(f"Term '{request.term}' already exists")
-            return glossary_pb2.OperationResponse(success=False, message="Term already exists")
-
-        self.glossary[term_key] = {
-            "term": request.term,
-            "definition": request.definition,
-            "category": request.category,
-            "examples": list(request.examples),
-            "created_at": current_time,
-            "updated_at": current_time
-        }
-
-        self.save_data()
-        return glossary_pb2.OperationResponse(
-            success=True,
-            message=f"Term '{request.term}' added successfully"
-        )
+# Логика словаря (хранение, горячая перезагрузка файла) общая с server.py
+class GlossaryService(BaseGlossaryService):
+    """Веб-интерфейс получает весь словарь целиком, без пагинации"""
 
     def ListAllTerms(self, request, context):
         all_terms = list(self.glossary.values())
@@ -134,11 +42,18 @@ class GlossaryService(glossary_pb2_grpc.GlossaryServiceServicer):
         )
 
 
+# Выставляется, когда словарь загружен, кэш прогрет и gRPC порт открыт
+grpc_ready = threading.Event()
+
+
 def serve_grpc():
     server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    glossary_pb2_grpc.add_GlossaryServiceServicer_to_server(GlossaryService(), server)
+    service = GlossaryService()
+    atexit.register(service.save_hot_terms)
+    glossary_pb2_grpc.add_GlossaryServiceServicer_to_server(service, server)
     server.add_insecure_port('[::]:50051')
     server.start()
+    grpc_ready.set()
     print("gRPC Server started on port 50051")
     server.wait_for_termination()
 
@@ -149,8 +64,8 @@ grpc_thread = threading.Thread(target=serve_grpc)
 grpc_thread.daemon = True
 grpc_thread.start()
 
-# Ждем немного чтобы gRPC сервер запустился
-time.sleep(2)
+# Ждем, пока gRPC сервер запустится
+grpc_ready.wait(timeout=30)
 
 
 # Создаем клиент для REST API
@@ -187,6 +102,20 @@ class GlossaryClient:
         except grpc.RpcError as e:
             return None
 
+    def related_terms(self, term, k=0):
+        try:
+            response = self.stub.RelatedTerms(glossary_pb2.RelatedTermsRequest(term=term, k=k))
+            return response
+        except grpc.RpcError as e:
+            return None
+
+    def top_terms(self, k=10, source=''):
+        try:
+            response = self.stub.TopTerms(glossary_pb2.TopTermsRequest(k=k, source=source))
+            return response
+        except grpc.RpcError as e:
+            return None
+
     def list_all_terms(self):
         try:
             response = self.stub.ListAllTerms(glossary_pb2.ListAllRequest())
@@ -383,12 +312,77 @@ def search_terms():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/related', methods=['GET'])
+def related_terms():
+    try:
+        term = request.args.get('term', '')
+        k = request.args.get('k', 0, type=int)
+        # 0 - число соседей по умолчанию
+        if not 0 <= k <= RELATED_MAX_K:
+            return jsonify({'error': f'k must be between 1 and {RELATED_MAX_K}'}), 400
+        result = glossary_client.related_terms(term, k)
+        if result is None:
+            return jsonify({'error': 'Term not found'}), 404
+        terms = []
+        for related in result.terms:
+            terms.append({
+                'term': related.term.term,
+                'definition': related.term.definition,
+                'category': related.term.category,
+                'examples': list(related.term.examples),
+                'score': round(related.score, 4)
+            })
+        return jsonify(terms)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/top', methods=['GET'])
+def top_terms():
+    try:
+        k = request.args.get('k', 10, type=int)
+        if k < 0:
+            return jsonify({'error': 'k must be non-negative'}), 400
+        result = glossary_client.top_terms(min(k, HOT_TERMS_CAPACITY), request.args.get('source', ''))
+        if result is None:
+            return jsonify({'error': "source must be 'get' or 'search'"}), 400
+        return jsonify({
+            'total': result.total,
+            'terms': [{'key': t.key, 'count': t.count, 'error': t.error} for t in result.terms]
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/admin/profile', methods=['GET'])
+def profile():
+    """?seconds=5&interval=0.005&top=20&format=json|collapsed, заголовок X-Admin-Token"""
+    if not is_admin(request.headers.get('X-Admin-Token', '')):
+        return jsonify({'error': 'Admin token required'}), 403
+    try:
+        result = profiler.run(request.args.get('seconds', 5, type=float),
+                              request.args.get('interval', 0.005, type=float),
+                              request.args.get('top', 20, type=int))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    if request.args.get('format') == 'collapsed':
+        return result['collapsed'] + '\n', 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    return jsonify(result)
+
+
 @app.route('/health', methods=['GET'])
 def health():
+    if not grpc_ready.is_set():
+        return jsonify({'status': 'starting', 'service': 'Python Glossary API'}), 503
     return jsonify({'status': 'healthy', 'service': 'Python Glossary API'})
 
 
 if __name__ == '__main__':
+    # docker stop присылает SIGTERM: завершаемся как по Ctrl+C, чтобы
+    # сработал atexit и популярные термины сохранились
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     print("Starting REST API server on http://localhost:5000")
     print("Open your browser and go to: http://localhost:5000")
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
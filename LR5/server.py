@@ -1,27 +1,141 @@
 import grpc
 from concurrent import futures
+import atexit
+import hmac
+import signal
 import time
 import json
 import os
+import threading
 from datetime import datetime
 
 import glossary_pb2
 import glossary_pb2_grpc
+from popularity import SpaceSaving
+from profiler import ProfilerBusy, SamplingProfiler
+from related import RelatedIndex
+
+# Период опроса glossary_data.json на внешние изменения (0 - не следить)
+RELOAD_INTERVAL = float(os.getenv('GLOSSARY_RELOAD_INTERVAL', '2'))
+# RelatedTerms: число соседей по умолчанию и максимум за один запрос
+RELATED_DEFAULT_K = 5
+RELATED_MAX_K = 50
+# Популярные термины: сколько ключей отслеживать, куда сохранять при
+# остановке и сколько самых частых прогревать при старте
+HOT_TERMS_FILE = os.getenv('GLOSSARY_HOT_FILE', 'glossary_hot.json')
+HOT_TERMS_CAPACITY = int(os.getenv('GLOSSARY_HOT_CAPACITY', '1000'))
+WARM_TERMS = int(os.getenv('GLOSSARY_WARM_TERMS', '100'))
+# Токен администратора для профилировщика (пусто - профилирование выключено)
+ADMIN_TOKEN = os.getenv('GLOSSARY_ADMIN_TOKEN', '')
+
+# Один на процесс: gRPC и REST не профилируют одновременно
+profiler = SamplingProfiler()
+
+
+def is_admin(token):
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+class GlossarySnapshot:
+    """Неизменяемый снимок словаря вместе с производными индексами"""
+    __slots__ = ('terms', 'search_text', 'related')
+
+    def __init__(self, terms, search_text, related):
+        self.terms = terms
+        # term_key -> (definition.lower(), category.lower()) для SearchTerms
+        self.search_text = search_text
+        # TF-IDF индекс для RelatedTerms
+        self.related = related
+
+
+def _search_text(term_data):
+    return term_data['definition'].lower(), term_data['category'].lower()
+
+
+def _term_response(term_data):
+    return glossary_pb2.TermResponse(
+        term=term_data['term'],
+        definition=term_data['definition'],
+        category=term_data['category'],
+        examples=term_data['examples'],
+        created_at=term_data['created_at'],
+        updated_at=term_data['updated_at']
+    )
 
 
 class GlossaryService(glossary_pb2_grpc.GlossaryServiceServicer):
-    def __init__(self):
-        self.data_file = 'glossary_data.json'
+    def __init__(self, data_file='glossary_data.json', reload_interval=RELOAD_INTERVAL,
+                 hot_file=HOT_TERMS_FILE):
+        self.data_file = data_file
+        self.hot_file = hot_file
+        # Частые ключи GetTerm и запросы SearchTerms в постоянной памяти
+        self.lookups = SpaceSaving(HOT_TERMS_CAPACITY)
+        self.searches = SpaceSaving(HOT_TERMS_CAPACITY)
+        # term_key -> (term_data, TermResponse) только для ключей из lookups;
+        # запись верна, пока в снимке тот же объект term_data
+        self._responses = {}
+        # Писатели (RPC и наблюдатель за файлом) сериализуются, читатели
+        # работают без блокировки с текущим снимком
+        self._write_lock = threading.Lock()
+        self._file_stamp = None
+        self.snapshot = GlossarySnapshot({}, {}, RelatedIndex.empty())
         self.load_data()
+        self.warm_up()
+        if reload_interval > 0:
+            self.start_watcher(reload_interval)
+
+    @property
+    def glossary(self):
+        return self.snapshot.terms
+
+    def _file_state(self):
+        try:
+            st = os.stat(self.data_file)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _read_file(self):
+        with open(self.data_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _apply(self, new_terms):
+        """Применяем новое состояние: пересчитываем только изменившиеся термины
+        и атомарно подменяем снимок. Возвращает (added, changed, removed)."""
+        old = self.snapshot
+        added, changed = [], []
+        for key, term_data in new_terms.items():
+            old_data = old.terms.get(key)
+            if old_data is None:
+                added.append(key)
+            elif old_data != term_data:
+                changed.append(key)
+            else:
+                # Переиспользуем уже загруженный объект термина
+                new_terms[key] = old_data
+        removed = [key for key in old.terms if key not in new_terms]
+        if not (added or changed or removed):
+            return added, changed, removed
+
+        search_text = dict(old.search_text)
+        for key in removed:
+            del search_text[key]
+        for key in added + changed:
+            search_text[key] = _search_text(new_terms[key])
+
+        related = old.related.updated(new_terms, added, changed, removed)
+        self.snapshot = GlossarySnapshot(new_terms, search_text, related)
+        return added, changed, removed
 
     def load_data(self):
         """Загружаем данные из JSON файла"""
         if os.path.exists(self.data_file):
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                self.glossary = json.load(f)
+            with self._write_lock:
+                self._file_stamp = self._file_state()
+                self._apply(self._read_file())
         else:
             # Инициализируем базовыми терминами Python
-            self.glossary = {
+            terms = {
                 "list": {
                     "term": "list",
                     "definition": "Встроенный тип данных в Python, представляющий упорядоченную изменяемую коллекцию элементов",
@@ -47,25 +161,101 @@ class GlossaryService(glossary_pb2_grpc.GlossaryServiceServicer):
                     "updated_at": "2024-01-01 10:00:00"
                 }
             }
-            self.save_data()
+            with self._write_lock:
+                self._apply(terms)
+                self.save_data()
 
     def save_data(self):
-        """Сохраняем данные в JSON файл"""
+        """Сохраняем данные в JSON файл (вызывается под _write_lock)"""
+        # Пишем на месте, а не через rename: файл примонтирован в контейнер
+        # как bind mount, и подменить его inode нельзя
         with open(self.data_file, 'w', encoding='utf-8') as f:
             json.dump(self.glossary, f, ensure_ascii=False, indent=2)
+        self._file_stamp = self._file_state()
+
+    def warm_up(self):
+        """Восстанавливаем популярные термины прошлого запуска и заранее
+        строим для них ответы и индекс RelatedTerms - до приёма запросов"""
+        if self.hot_file and os.path.exists(self.hot_file):
+            try:
+                with open(self.hot_file, 'r', encoding='utf-8') as f:
+                    hot = json.load(f)
+                self.lookups.load(hot.get('lookups', []))
+                self.searches.load(hot.get('searches', []))
+            except (OSError, ValueError) as e:
+                print(f"Hot terms not loaded: {e}")
+
+        snapshot = self.snapshot
+        warmed = 0
+        for term_key, _, _ in self.lookups.top(WARM_TERMS):
+            term_data = snapshot.terms.get(term_key)
+            if term_data is not None:
+                self._responses[term_key] = (term_data, _term_response(term_data))
+                warmed += 1
+        snapshot.related.warm()
+        print(f"Warmed up {warmed} hot terms")
+
+    def save_hot_terms(self):
+        """Сохраняем счётчики популярности (при остановке сервера)"""
+        if not self.hot_file:
+            return
+        os.makedirs(os.path.dirname(self.hot_file) or '.', exist_ok=True)
+        tmp = self.hot_file + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'lookups': self.lookups.dump(), 'searches': self.searches.dump()},
+                      f, ensure_ascii=False)
+        os.replace(tmp, self.hot_file)
+
+    def reload_if_changed(self):
+        """Перечитываем файл, если его изменили снаружи"""
+        stamp = self._file_state()
+        if stamp is None or stamp == self._file_stamp:
+            return False
+        with self._write_lock:
+            try:
+                new_terms = self._read_file()
+            except (OSError, ValueError) as e:
+                # Файл могут дописывать прямо сейчас - попробуем на следующем шаге
+                print(f"Glossary reload skipped: {e}")
+                return False
+            self._file_stamp = stamp
+            added, changed, removed = self._apply(new_terms)
+        if added or changed or removed:
+            print(f"Glossary reloaded: +{len(added)} ~{len(changed)} -{len(removed)}")
+        return True
+
+    def start_watcher(self, interval):
+        """Фоновый поток, следящий за mtime/размером файла данных"""
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    print(f"Glossary watcher error: {e}")
+
+        thread = threading.Thread(target=watch, name='glossary-watcher', daemon=True)
+        thread.start()
+        return thread
+
+    def _commit(self, new_terms):
+        self._apply(new_terms)
+        self.save_data()
 
     def GetTerm(self, request, context):
         term_key = request.term.lower()
-        if term_key in self.glossary:
-            term_data = self.glossary[term_key]
-            return glossary_pb2.TermResponse(
-                term=term_data['term'],
-                definition=term_data['definition'],
-                category=term_data['category'],
-                examples=term_data['examples'],
-                created_at=term_data['created_at'],
-                updated_at=term_data['updated_at']
-            )
+        evicted = self.lookups.add(term_key)
+        if evicted is not None:
+            self._responses.pop(evicted, None)
+        term_data = self.glossary.get(term_key)
+        if term_data is not None:
+            cached = self._responses.get(term_key)
+            if cached is not None and cached[0] is term_data:
+                return cached[1]
+            response = _term_response(term_data)
+            if term_key in self.lookups:
+                self._responses[term_key] = (term_data, response)
+            return response
         else:
             context.set_code(grpc.StatusCode.NOT_FOUND)
             context.set_details(f"Term '{request.term}' not found")
@@ -73,12 +263,15 @@ class GlossaryService(glossary_pb2_grpc.GlossaryServiceServicer):
 
     def SearchTerms(self, request, context):
         query = request.query.lower()
+        self.searches.add(query.strip())
         results = []
+        snapshot = self.snapshot
 
-        for term_key, term_data in self.glossary.items():
+        for term_key, term_data in snapshot.terms.items():
+            definition, category = snapshot.search_text[term_key]
             if (query in term_key or
-                    query in term_data['definition'].lower() or
-                    query in term_data['category'].lower()):
+                    query in definition or
+                    query in category):
                 results.append(glossary_pb2.TermResponse(
                     term=term_data['term'],
                     definition=term_data['definition'],
@@ -93,25 +286,89 @@ class GlossaryService(glossary_pb2_grpc.GlossaryServiceServicer):
             total_count=len(results)
         )
 
+    def RelatedTerms(self, request, context):
+        term_key = request.term.lower()
+        k = request.k or RELATED_DEFAULT_K
+        if not 0 < k <= RELATED_MAX_K:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"k must be between 1 and {RELATED_MAX_K}")
+            return glossary_pb2.RelatedTermsResponse()
+
+        snapshot = self.snapshot
+        related = snapshot.related.related(term_key, k)
+        if related is None:
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            context.set_details(f"Term '{request.term}' not found")
+            return glossary_pb2.RelatedTermsResponse()
+
+        results = []
+        for key, score in related:
+            term_data = snapshot.terms[key]
+            results.append(glossary_pb2.RelatedTerm(term=_term_response(term_data), score=score))
+        return glossary_pb2.RelatedTermsResponse(terms=results)
+
+    def TopTerms(self, request, context):
+        if request.source not in ('', 'get', 'search'):
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("source must be 'get' or 'search'")
+            return glossary_pb2.TopTermsResponse()
+        if request.k < 0:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("k must be non-negative")
+            return glossary_pb2.TopTermsResponse()
+        sketch = self.searches if request.source == 'search' else self.lookups
+        # Больше, чем отслеживает скетч, ключей все равно нет
+        k = min(request.k or 10, sketch.capacity)
+        return glossary_pb2.TopTermsResponse(
+            terms=[glossary_pb2.TopTerm(key=key, count=count, error=error)
+                   for key, count, error in sketch.top(k)],
+            total=sketch.total
+        )
+
+    def Profile(self, request, context):
+        token = dict(context.invocation_metadata()).get('x-admin-token', '')
+        if not is_admin(token):
+            context.set_code(grpc.StatusCode.PERMISSION_DENIED)
+            context.set_details("Admin token required")
+            return glossary_pb2.ProfileResponse()
+        try:
+            result = profiler.run(request.seconds or 5, request.interval or 0.005,
+                                  request.top_allocations or 20)
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            return glossary_pb2.ProfileResponse()
+        except ProfilerBusy as e:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(str(e))
+            return glossary_pb2.ProfileResponse()
+        return glossary_pb2.ProfileResponse(
+            collapsed=result['collapsed'],
+            samples=result['samples'],
+            allocations=[glossary_pb2.Allocation(**a) for a in result['allocations']]
+        )
+
     def AddTerm(self, request, context):
         term_key = request.term.lower()
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        if term_key in self.glossary:
-            context.set_code(grpc.StatusCode.ALREADY_EXISTS)
-            context.set_details(f"Term '{request.term}' already exists")
-            return glossary_pb2.OperationResponse(success=False, message="Term already exists")
+        with self._write_lock:
+            if term_key in self.glossary:
+                context.set_code(grpc.StatusCode.ALREADY_EXISTS)
+                context.set_details(f"Term '{request.term}' already exists")
+                return glossary_pb2.OperationResponse(success=False, message="Term already exists")
 
-        self.glossary[term_key] = {
-            "term": request.term,
-            "definition": request.definition,
-            "category": request.category,
-            "examples": list(request.examples),
-            "created_at": current_time,
-            "updated_at": current_time
-        }
+            new_terms = dict(self.glossary)
+            new_terms[term_key] = {
+                "term": request.term,
+                "definition": request.definition,
+                "category": request.category,
+                "examples": list(request.examples),
+                "created_at": current_time,
+                "updated_at": current_time
+            }
+            self._commit(new_terms)
 
-        self.save_data()
         return glossary_pb2.OperationResponse(
             success=True,
             message=f"Term '{request.term}' added successfully"
@@ -121,19 +378,22 @@ class GlossaryService(glossary_pb2_grpc.GlossaryServiceServicer):
         term_key = request.term.lower()
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        if term_key not in self.glossary:
-            context.set_code(grpc.StatusCode.NOT_FOUND)
-            context.set_details(f"Term '{request.term}' not found")
-            return glossary_pb2.OperationResponse(success=False, message="Term not found")
+        with self._write_lock:
+            if term_key not in self.glossary:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Term '{request.term}' not found")
+                return glossary_pb2.OperationResponse(success=False, message="Term not found")
 
-        self.glossary[term_key].update({
-            "definition": request.definition,
-            "category": request.category,
-            "examples": list(request.examples),
-            "updated_at": current_time
-        })
+            # Не меняем объект термина на месте: его могут читать другие потоки
+            new_terms = dict(self.glossary)
+            new_terms[term_key] = dict(new_terms[term_key], **{
+                "definition": request.definition,
+                "category": request.category,
+                "examples": list(request.examples),
+                "updated_at": current_time
+            })
+            self._commit(new_terms)
 
-        self.save_data()
         return glossary_pb2.OperationResponse(
             success=True,
             message=f"Term '{request.term}' updated successfully"
@@ -142,13 +402,15 @@ class GlossaryService(glossary_pb2_grpc.GlossaryServiceServicer):
     def DeleteTerm(self, request, context):
         term_key = request.term.lower()
 
-        if term_key not in self.glossary:
-            context.set_code(grpc.StatusCode.NOT_FOUND)
-            context.set_details(f"Term '{request.term}' not found")
-            return glossary_pb2.OperationResponse(success=False, message="Term not found")
+        with self._write_lock:
+            if term_key not in self.glossary:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Term '{request.term}' not found")
+                return glossary_pb2.OperationResponse(success=False, message="Term not found")
 
-        del self.glossary[term_key]
-        self.save_data()
+            new_terms = dict(self.glossary)
+            del new_terms[term_key]
+            self._commit(new_terms)
         return glossary_pb2.OperationResponse(
             success=True,
             message=f"Term '{request.term}' deleted successfully"
@@ -185,7 +447,12 @@ class GlossaryService(glossary_pb2_grpc.GlossaryServiceServicer):
 
 def serve():
     server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    glossary_pb2_grpc.add_GlossaryServiceServicer_to_server(GlossaryService(), server)
+    # Прогрев идёт в конструкторе: порт открывается уже с тёплым кэшем
+    service = GlossaryService()
+    atexit.register(service.save_hot_terms)
+    # docker stop присылает SIGTERM - завершаемся так же, как по Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    glossary_pb2_grpc.add_GlossaryServiceServicer_to_server(service, server)
     server.add_insecure_port('[::]:50051')
     server.start()
     print("gRPC Server started on port 50051")
@@ -0,0 +1,347 @@
+"""Нагрузочный тест рассылки курсов: много WebSocket-клиентов и обновления курсов.
+
+Скрипт сам запускает mock_cbr.py и main.py, подключает клиентов из нескольких
+процессов, меняет курсы через POST /bump и печатает результаты в JSON:
+
+    python benchmark.py --clients 5000 --processes 4 --updates 20
+    python benchmark.py --clients 2000 --workers 4 --binary --output result.json
+
+Задержки:
+    fanout      - от отметки времени в сообщении (публикация на сервере) до получения;
+    end_to_end  - от POST /bump до получения (включает интервал опроса источника).
+Клиенты и сервер работают на одной машине, поэтому часы у них общие.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import tornado.httpclient
+import tornado.websocket
+
+from main import BINARY_HEADER, SUBPROTOCOL_BINARY
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def raise_fd_limit():
+    """Тысячи соединений не помещаются в стандартный лимит 1024 дескриптора"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def process_tree(pid):
+    """pid процесса и всех его потомков (Linux /proc)"""
+    pids = [pid]
+    for child in pids:
+        try:
+            with open(f'/proc/{child}/task/{child}/children') as f:
+                pids.extend(int(p) for p in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def server_usage(pid):
+    """(процессорное время в секундах, RSS в байтах) сервера со всеми воркерами"""
+    cpu, rss = 0.0, 0
+    for p in process_tree(pid):
+        try:
+            with open(f'/proc/{p}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open(f'/proc/{p}/statm') as f:
+                rss += int(f.read().split()[1]) * PAGE_SIZE
+        except OSError:
+            continue
+        # utime и stime - 14-е и 15-е поля, считая с pid
+        cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return cpu, rss
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+
+    return {
+        'count': len(values),
+        'p50': pick(0.50),
+        'p90': pick(0.90),
+        'p99': pick(0.99),
+        'p999': pick(0.999),
+        'max': round(values[-1] * 1000, 3),
+    }
+
+
+def parse_message(message):
+    """(тип, seq, время публикации) из JSON или двоичного сообщения"""
+    if isinstance(message, bytes):
+        message_type, seq, _, _, published, _ = BINARY_HEADER.unpack_from(message)
+        return {1: 'currency_rates', 2: 'rates_snapshot', 3: 'rates_delta'}[message_type], seq, published
+    data = json.loads(message)
+    published = data.get('timestamp')
+    if published is not None:
+        published = datetime.datetime.fromisoformat(published).timestamp()
+    return data['type'], data.get('seq'), published
+
+
+async def run_clients(url, count, options, connected, stop):
+    """Подключение count клиентов и сбор (номер обновления, время публикации, время получения).
+
+    Номер обновления - на сколько seq ушел от снимка, полученного при
+    подключении (0 - первое /bump): каждое /bump меняет курсы ровно один раз."""
+    connect_kwargs = {}
+    if options['binary']:
+        connect_kwargs['subprotocols'] = [SUBPROTOCOL_BINARY]
+    if options['compression']:
+        connect_kwargs['compression_options'] = {}
+    semaphore = asyncio.Semaphore(options['connect_concurrency'])
+    received = []
+    failures = []
+
+    async def client():
+        async with semaphore:
+            try:
+                conn = await tornado.websocket.websocket_connect(url, **connect_kwargs)
+            except (OSError, tornado.httpclient.HTTPClientError) as e:
+                failures.append(str(e))
+                return None
+        return conn
+
+    async def read(conn):
+        baseline = last = None
+        while True:
+            message = await conn.read_message()
+            now = time.time()
+            if message is None:
+                return
+            message_type, seq, published = parse_message(message)
+            if message_type not in ('rates_snapshot', 'rates_delta', 'currency_rates'):
+                continue
+            if baseline is None:
+                # Курсы при подключении, до первого /bump
+                baseline = last = seq
+                continue
+            # Протокол 'full' повторяет весь набор на каждом опросе:
+            # обновлением считается только кадр с новым seq
+            if seq == last:
+                continue
+            last = seq
+            received.append((seq - baseline - 1, published, now))
+
+    started = time.time()
+    conns = [conn for conn in await asyncio.gather(*(client() for _ in range(count)))
+             if conn is not None]
+    finished = time.time()
+    connected.put({'started': started, 'finished': finished,
+                   'established': len(conns), 'failed': len(failures),
+                   'errors': sorted(set(failures))[:5]})
+
+    readers = [asyncio.ensure_future(read(conn)) for conn in conns]
+    while not stop.is_set():
+        await asyncio.sleep(0.1)
+    for reader in readers:
+        reader.cancel()
+    for conn in conns:
+        conn.close()
+    return received
+
+
+def client_process(url, count, options, connected, results, stop):
+    raise_fd_limit()
+    received = asyncio.run(run_clients(url, count, options, connected, stop))
+    results.put(received)
+
+
+def wait_http(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                return response.read()
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def run_benchmark(args):
+    raise_fd_limit()
+    mock_url = f'http://127.0.0.1:{args.mock_port}'
+    server_url = f'http://127.0.0.1:{args.port}'
+    history_dir = tempfile.mkdtemp(prefix='lr6-bench-')
+    env = dict(
+        os.environ,
+        CBR_API_URL=f'{mock_url}/daily_json.js',
+        RATES_POLL_INTERVAL=str(args.poll_interval),
+        RATES_MAX_POLL_INTERVAL=str(args.poll_interval),
+        RATES_HISTORY_FILE=os.path.join(history_dir, 'rates_history.bin'),
+        RATES_BUS=f'unix://{os.path.join(history_dir, "bus.sock")}',
+        WS_MAX_CONNECTIONS='0',
+        WS_COMPRESSION='1' if args.compression else '0',
+    )
+    server_log = open(args.server_log, 'w') if args.server_log else subprocess.DEVNULL
+    server_cmd = [sys.executable, 'main.py', '--port', str(args.port)]
+    if args.workers:
+        server_cmd += ['--workers', str(args.workers)]
+
+    mock = subprocess.Popen([sys.executable, 'mock_cbr.py', '--port', str(args.mock_port), '--seed', '1'],
+                            cwd=HERE, stdout=subprocess.DEVNULL)
+    server = None
+    workers = []
+    try:
+        wait_http(f'{mock_url}/stats')
+        server = subprocess.Popen(server_cmd, cwd=HERE, env=env, stdout=server_log, stderr=server_log)
+        wait_http(f'{server_url}/')
+        # Ждем первого опроса источника, чтобы все клиенты получили один и тот же снимок
+        while json.loads(wait_http(f'{mock_url}/stats'))['requests'] < 1:
+            time.sleep(0.1)
+        time.sleep(args.poll_interval)
+        cpu_idle, rss_idle = server_usage(server.pid)
+        log(f"🚀 Сервер запущен, RSS {rss_idle / 2**20:.1f} МБ")
+
+        options = {'binary': args.binary, 'compression': args.compression,
+                   'connect_concurrency': args.connect_concurrency}
+        ws_url = f'ws://127.0.0.1:{args.port}/websocket?protocol={args.protocol}'
+        connected, results, stop = multiprocessing.Queue(), multiprocessing.Queue(), multiprocessing.Event()
+        shares = [args.clients // args.processes + (i < args.clients % args.processes)
+                  for i in range(args.processes)]
+        for share in shares:
+            process = multiprocessing.Process(
+                target=client_process, args=(ws_url, share, options, connected, results, stop))
+            process.start()
+            workers.append(process)
+        reports = [connected.get() for _ in workers]
+        established = sum(r['established'] for r in reports)
+        setup_seconds = max(r['finished'] for r in reports) - min(r['started'] for r in reports)
+        log(f"🔌 Подключено {established} из {args.clients} за {setup_seconds:.2f} с")
+
+        time.sleep(1)
+        cpu_connected, rss_connected = server_usage(server.pid)
+
+        bump_times = []
+        started = time.monotonic()
+        for _ in range(args.updates):
+            bump_times.append(time.time())
+            urllib.request.urlopen(urllib.request.Request(f'{mock_url}/bump', method='POST')).read()
+            time.sleep(args.interval)
+        # Даем дойти последнему обновлению
+        time.sleep(args.poll_interval + 1)
+        update_seconds = time.monotonic() - started
+        cpu_updates, rss_updates = server_usage(server.pid)
+
+        stop.set()
+        received = []
+        for _ in workers:
+            received.extend(results.get())
+        for process in workers:
+            process.join()
+    finally:
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+        for process in (server, mock):
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    fanout, end_to_end = [], []
+    for i, published, received_at in received:
+        if published is not None:
+            fanout.append(received_at - published)
+        if 0 <= i < len(bump_times):
+            end_to_end.append(received_at - bump_times[i])
+
+    cpu_spent = cpu_updates - cpu_connected
+    return {
+        'config': {
+            'clients': args.clients,
+            'client_processes': args.processes,
+            'server_workers': args.workers,
+            'updates': args.updates,
+            'interval': args.interval,
+            'poll_interval': args.poll_interval,
+            'protocol': args.protocol,
+            'binary': args.binary,
+            'compression': args.compression,
+        },
+        'connections': {
+            'established': established,
+            'failed': sum(r['failed'] for r in reports),
+            'errors': sorted({e for r in reports for e in r['errors']})[:5],
+            'setup_seconds': round(setup_seconds, 3),
+            'setup_rate_per_s': round(established / setup_seconds, 1) if setup_seconds else None,
+        },
+        'latency_ms': {
+            'fanout': percentiles(fanout),
+            'end_to_end': percentiles(end_to_end),
+        },
+        'delivery': {
+            'expected_messages': established * args.updates,
+            'received_messages': len(received),
+            'distinct_updates': len({i for i, _, _ in received}),
+        },
+        'server': {
+            'rss_idle_mb': round(rss_idle / 2**20, 2),
+            'rss_connected_mb': round(rss_connected / 2**20, 2),
+            'rss_after_updates_mb': round(rss_updates / 2**20, 2),
+            'rss_per_connection_kb': round((rss_connected - rss_idle) / established / 1024, 2)
+            if established else None,
+            'cpu_seconds_connect': round(cpu_connected - cpu_idle, 3),
+            'cpu_ms_per_connection': round((cpu_connected - cpu_idle) / established * 1000, 3)
+            if established else None,
+            'cpu_seconds_updates': round(cpu_spent, 3),
+            'cpu_percent_updates': round(cpu_spent / update_seconds * 100, 1),
+            'cpu_ms_per_update': round(cpu_spent / args.updates * 1000, 3) if args.updates else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LR6 WebSocket fan-out benchmark')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--processes', type=int, default=2, help='процессов с клиентами')
+    parser.add_argument('--workers', type=int, default=0, help='воркеров сервера (main.py --workers)')
+    parser.add_argument('--updates', type=int, default=10, help='сколько раз менять курсы')
+    parser.add_argument('--interval', type=float, default=1.0, help='пауза между обновлениями, с')
+    parser.add_argument('--poll-interval', type=float, default=0.2, help='интервал опроса mock-источника, с')
+    parser.add_argument('--protocol', choices=['delta', 'full'], default='delta')
+    parser.add_argument('--binary', action='store_true', help='подпротокол rates.v1.bin')
+    parser.add_argument('--compression', action='store_true', help='permessage-deflate')
+    parser.add_argument('--connect-concurrency', type=int, default=200,
+                        help='одновременных рукопожатий на процесс')
+    parser.add_argument('--port', type=int, default=18888)
+    parser.add_argument('--mock-port', type=int, default=18899)
+    parser.add_argument('--server-log', help='файл для вывода сервера')
+    parser.add_argument('--output', help='файл для JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+
+    result = json.dumps(run_benchmark(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(result + '\n')
+        log(f"📄 Результаты записаны в {args.output}")
+    else:
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
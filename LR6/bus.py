@@ -0,0 +1,160 @@
+"""Шина pub/sub между процессами сервера курсов.
+
+Адрес шины задается URL:
+    redis://localhost:6379/0        - Redis (нужен пакет redis>=4.2)
+    unix:///tmp/lr6-rates.sock      - локальный брокер на Unix-сокете (UnixSocketBroker)
+
+Сообщения - JSON-объекты; подписчик получает все сообщения своих каналов,
+включая отправленные им самим (как в Redis). Потеря соединения с шиной
+любого типа выдается как ConnectionError.
+"""
+import asyncio
+import json
+import os
+
+# Максимальный размер одного сообщения брокера
+MAX_LINE = 4 * 1024 * 1024
+
+
+class UnixSocketBroker:
+    """Простейший брокер: пересылает каждую строку всем подключенным клиентам"""
+
+    def __init__(self, path, max_buffer=1024 * 1024):
+        self.path = path
+        self.max_buffer = max_buffer
+        self.writers = set()
+        self.server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self._handle, self.path, limit=MAX_LINE)
+        return self
+
+    async def _handle(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for other in list(self.writers):
+                    # Подписчик, который не забирает данные, отключается
+                    if other.transport.get_write_buffer_size() > self.max_buffer:
+                        other.close()
+                        self.writers.discard(other)
+                        continue
+                    other.write(line)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # Остановка брокера: задача обработчика завершается тихо
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for writer in list(self.writers):
+            writer.close()
+
+
+class UnixSocketBus:
+    """Клиент UnixSocketBroker"""
+
+    def __init__(self, path):
+        self.path = path
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path, limit=MAX_LINE)
+
+    async def publish(self, channel, message):
+        line = json.dumps({'channel': channel, 'data': message}).encode('utf-8') + b'\n'
+        self.writer.write(line)
+        await self.writer.drain()
+
+    async def listen(self, channels):
+        """Подписка на каналы; возвращает асинхронный итератор (channel, message).
+
+        Брокер пересылает клиенту все сообщения с момента подключения,
+        поэтому подписка действует уже до возврата из listen()."""
+        return self._messages(set(channels))
+
+    async def _messages(self, channels):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise ConnectionError("bus connection closed")
+            envelope = json.loads(line)
+            if envelope['channel'] in channels:
+                yield envelope['channel'], envelope['data']
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class RedisBus:
+    """Шина поверх Redis PUBLISH/SUBSCRIBE"""
+
+    def __init__(self, url):
+        self.url = url
+        self.redis = None
+
+    async def connect(self):
+        import redis.asyncio as redis  # необязательная зависимость
+        from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+        # Ошибки соединения redis не наследуют встроенный ConnectionError
+        self.errors = (RedisConnectionError, RedisTimeoutError)
+        self.redis = redis.Redis.from_url(self.url)
+        try:
+            await self.redis.ping()
+        except self.errors as e:
+            raise ConnectionError(str(e)) from e
+
+    async def publish(self, channel, message):
+        try:
+            await self.redis.publish(channel, json.dumps(message))
+        except self.errors as e:
+            raise ConnectionError(str(e)) from e
+
+    async def listen(self, channels):
+        """Подписка на каналы; возвращает асинхронный итератор (channel, message).
+
+        SUBSCRIBE выполняется здесь, а не на первом шаге итерации: сообщения,
+        отправленные после возврата из listen(), уже не теряются."""
+        pubsub = self.redis.pubsub()
+        try:
+            await pubsub.subscribe(*channels)
+        except self.errors as e:
+            await pubsub.close()
+            raise ConnectionError(str(e)) from e
+        return self._messages(pubsub)
+
+    async def _messages(self, pubsub):
+        try:
+            async for item in pubsub.listen():
+                if item['type'] == 'message':
+                    yield item['channel'].decode('utf-8'), json.loads(item['data'])
+        except self.errors as e:
+            raise ConnectionError(str(e)) from e
+        finally:
+            await pubsub.close()
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.close()
+
+
+def make_bus(url):
+    if url.startswith('unix://'):
+        return UnixSocketBus(url[len('unix://'):])
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisBus(url)
+    raise ValueError(f"unsupported bus URL: {url}")
@@ -0,0 +1,67 @@
+"""Матрица кросс-курсов всех валют ЦБ, пересчитываемая векторно через NumPy."""
+import numpy as np
+
+BASE_CURRENCY = 'RUB'
+
+
+class CrossRates:
+    """Матрица N x N: matrix[i, j] - сколько единиц валюты j стоит единица валюты i.
+
+    Курсы к рублю хранятся в одном массиве float64 в порядке self.codes;
+    матрица пересчитывается одной операцией при каждом обновлении, после
+    чего любая пара читается за O(1)."""
+
+    def __init__(self):
+        self.codes = [BASE_CURRENCY]
+        self.index = {BASE_CURRENCY: 0}
+        self.values = np.ones(1)
+        self.matrix = np.ones((1, 1))
+
+    def update(self, rates):
+        """rates: {код: рублей за одну единицу валюты}"""
+        for code in rates:
+            if code not in self.index:
+                self.index[code] = len(self.codes)
+                self.codes.append(code)
+        if len(self.values) != len(self.codes):
+            self.values = np.resize(self.values, len(self.codes))
+        for code, value in rates.items():
+            self.values[self.index[code]] = value
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            matrix = self.values[:, np.newaxis] / self.values[np.newaxis, :]
+        # Валюты без курса (0) дают inf/nan - такие пары считаем неизвестными
+        matrix[~np.isfinite(matrix)] = np.nan
+        self.matrix = matrix
+
+    def rate(self, base, quote):
+        """Цена одной единицы base в единицах quote или None"""
+        i = self.index.get(base)
+        j = self.index.get(quote)
+        if i is None or j is None:
+            return None
+        value = self.matrix[i, j]
+        return None if np.isnan(value) else float(value)
+
+    def row(self, base):
+        """Все курсы base к остальным валютам"""
+        i = self.index.get(base)
+        if i is None:
+            return None
+        return {code: float(value) for code, value in zip(self.codes, self.matrix[i])
+                if not np.isnan(value)}
+
+    def pairs(self, pairs):
+        """{'USD/EUR': курс} для набора пар вида (base, quote)"""
+        result = {}
+        for base, quote in pairs:
+            result[f'{base}/{quote}'] = self.rate(base, quote)
+        return result
+
+
+def parse_pair(pair):
+    """'usd/eur' -> ('USD', 'EUR')"""
+    base, sep, quote = pair.upper().partition('/')
+    if not sep or not base or not quote:
+        raise ValueError(f"invalid currency pair: {pair!r}")
+    return base, quote
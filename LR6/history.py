@@ -0,0 +1,211 @@
+"""История курсов в памяти: кольцевые буферы array('d') на валюту.
+
+Для каждой валюты хранится несколько уровней детализации: исходные точки
+и свертки по минутам, часам и дням. Свертка хранит последнее значение
+(close) в интервале, поэтому старые данные занимают постоянный объем.
+"""
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+# Уровень -> (длительность интервала в секундах, емкость буфера)
+LEVELS = {
+    'raw': (0, 2880),
+    'minute': (60, 1440),      # сутки
+    'hour': (3600, 24 * 90),   # 90 дней
+    'day': (86400, 365 * 5),   # 5 лет
+}
+
+_FILE_MAGIC = b'RHIST001'
+_RECORD_HEADER = struct.Struct('<8s8sI')  # валюта, уровень, число точек
+# Массивы в файле хранятся в little-endian
+_SWAP_BYTES = sys.byteorder != 'little'
+
+
+class RingSeries:
+    """Кольцевой буфер пар (время, значение) фиксированной емкости"""
+    __slots__ = ('capacity', 'times', 'values', 'start', 'size')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _index(self, i):
+        return (self.start + i) % self.capacity
+
+    def last(self):
+        if not self.size:
+            return None
+        i = self._index(self.size - 1)
+        return self.times[i], self.values[i]
+
+    def append(self, t, value):
+        if self.size < self.capacity:
+            i = self._index(self.size)
+            self.size += 1
+        else:
+            i = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.times[i] = t
+        self.values[i] = value
+
+    def replace_last(self, value):
+        self.values[self._index(self.size - 1)] = value
+
+    def ordered(self):
+        """Копии времен и значений в хронологическом порядке"""
+        end = self.start + self.size
+        if end <= self.capacity:
+            return self.times[self.start:end], self.values[self.start:end]
+        tail = end - self.capacity
+        return (self.times[self.start:] + self.times[:tail],
+                self.values[self.start:] + self.values[:tail])
+
+    def range(self, t_from=None, t_to=None):
+        times, values = self.ordered()
+        lo = 0 if t_from is None else bisect_left(times, t_from)
+        hi = len(times) if t_to is None else bisect_right(times, t_to)
+        return times[lo:hi], values[lo:hi]
+
+
+class RateHistory:
+    """Многоуровневая история курсов всех валют"""
+
+    def __init__(self, levels=LEVELS):
+        self.levels = levels
+        self.series = {}
+        # Растет при каждой записи: по нему кэшируются производные данные
+        self.version = 0
+        self.saved_version = 0
+
+    def _currency_series(self, currency):
+        series = self.series.get(currency)
+        if series is None:
+            series = {level: RingSeries(capacity) for level, (_, capacity) in self.levels.items()}
+            self.series[currency] = series
+        return series
+
+    def record(self, t, rates):
+        """Запись курсов, полученных в момент t (unix-время)"""
+        for currency, value in rates.items():
+            for level, ring in self._currency_series(currency).items():
+                bucket = self.levels[level][0]
+                if not bucket:
+                    ring.append(t, value)
+                    continue
+                bucket_start = t - t % bucket
+                last = ring.last()
+                if last is not None and last[0] == bucket_start:
+                    ring.replace_last(value)
+                else:
+                    ring.append(bucket_start, value)
+        self.version += 1
+
+    def query(self, currency, t_from=None, t_to=None, step=None):
+        """Точки [(t, value)] за период с шагом step (секунды или имя уровня).
+
+        Берется самый грубый уровень, который не грубее шага, после чего
+        точки дополнительно сворачиваются до шага по последнему значению."""
+        series = self.series.get(currency)
+        if series is None:
+            return []
+        if isinstance(step, str):
+            step = self.levels[step][0]
+        step = step or 0
+
+        level = max((name for name, (bucket, _) in self.levels.items() if bucket <= step),
+                    key=lambda name: self.levels[name][0])
+        times, values = series[level].range(t_from, t_to)
+        if step <= self.levels[level][0]:
+            return list(zip(times, values))
+
+        points = []
+        for t, value in zip(times, values):
+            bucket_start = t - t % step
+            if points and points[-1][0] == bucket_start:
+                points[-1] = (bucket_start, value)
+            else:
+                points.append((bucket_start, value))
+        return points
+
+    def tail(self, limit, level='minute'):
+        """Последние limit точек каждой валюты - для клиентов при подключении"""
+        result = {}
+        for currency, series in self.series.items():
+            times, values = series[level].ordered()
+            result[currency] = list(zip(times[-limit:], values[-limit:]))
+        return result
+
+    def snapshot(self):
+        """Копия всех буферов: [(валюта, уровень, times, values)]"""
+        records = []
+        for currency, series in self.series.items():
+            for level, ring in series.items():
+                records.append((currency, level) + ring.ordered())
+        return self.version, records
+
+    @staticmethod
+    def write(path, records):
+        """Запись снимка в двоичный файл (атомарно, через временный файл).
+
+        Может выполняться в отдельном потоке: снимок уже скопирован."""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_FILE_MAGIC)
+            for currency, level, times, values in records:
+                f.write(_RECORD_HEADER.pack(currency.encode('ascii'), level.encode('ascii'),
+                                            len(times)))
+                if _SWAP_BYTES:
+                    times.byteswap()
+                    values.byteswap()
+                times.tofile(f)
+                values.tofile(f)
+        os.replace(tmp_path, path)
+
+    def save(self, path):
+        version, records = self.snapshot()
+        self.write(path, records)
+        self.saved_version = version
+
+    def load(self, path):
+        """Загрузка истории из файла.
+
+        Файл сначала читается целиком: поврежденный файл (ValueError или
+        EOFError) не оставляет историю загруженной наполовину."""
+        if not os.path.exists(path):
+            return False
+        records = []
+        with open(path, 'rb') as f:
+            if f.read(len(_FILE_MAGIC)) != _FILE_MAGIC:
+                raise ValueError(f"{path}: unknown history file format")
+            while True:
+                header = f.read(_RECORD_HEADER.size)
+                if not header:
+                    break
+                if len(header) < _RECORD_HEADER.size:
+                    raise EOFError(f"{path}: truncated record header")
+                currency, level, count = _RECORD_HEADER.unpack(header)
+                currency = currency.rstrip(b'\0').decode('ascii')
+                level = level.rstrip(b'\0').decode('ascii')
+                times, values = array('d'), array('d')
+                times.fromfile(f, count)
+                values.fromfile(f, count)
+                if _SWAP_BYTES:
+                    times.byteswap()
+                    values.byteswap()
+                if level in self.levels:
+                    records.append((currency, level, times, values))
+        for currency, level, times, values in records:
+            ring = self._currency_series(currency)[level]
+            for t, value in zip(times, values):
+                ring.append(t, value)
+        self.saved_version = self.version
+        return True
@@ -1,70 +1,526 @@
 import tornado.ioloop
 import tornado.web
 import tornado.websocket
+import tornado.iostream
+import tornado.httpserver
+import tornado.netutil
+import argparse
 import json
 import datetime
 import asyncio
 import aiohttp
+import hashlib
+import logging
+import math
+import multiprocessing
 import os
+import signal
+import socket
+import struct
+import time
+import zlib
 
-CBR_API_URL = "https://www.cbr-xml-daily.ru/daily_json.js"
+from bus import UnixSocketBroker, make_bus
+from cross_rates import CrossRates, parse_pair
+from history import RateHistory
+from metrics import Registry, setup_logging, stop_logging
+
+# Источник курсов можно подменить, например, на локальный mock_cbr.py
+CBR_API_URL = os.getenv('CBR_API_URL', "https://www.cbr-xml-daily.ru/daily_json.js")
+# Таймаут запроса к источнику курсов, секунды
+FETCH_TIMEOUT = float(os.getenv('RATES_FETCH_TIMEOUT', 10))
+# Базовый и максимальный интервал опроса: пока данные не меняются,
+# интервал удваивается до максимума
+POLL_INTERVAL = float(os.getenv('RATES_POLL_INTERVAL', 30))
+MAX_POLL_INTERVAL = float(os.getenv('RATES_MAX_POLL_INTERVAL', 300))
+
+# Ограничение исходящей очереди одного клиента (в неотправленных кадрах)
+MAX_PENDING_FRAMES = int(os.getenv('WS_MAX_PENDING_FRAMES', 4))
+# Сколько секунд клиент может не успевать за рассылкой, прежде чем его отключат
+SLOW_CLIENT_TIMEOUT = float(os.getenv('WS_SLOW_CLIENT_TIMEOUT', 10))
+# Файл и период сохранения истории курсов, число точек истории для новых клиентов
+HISTORY_FILE = os.getenv('RATES_HISTORY_FILE', 'rates_history.bin')
+HISTORY_SAVE_INTERVAL = float(os.getenv('RATES_HISTORY_SAVE_INTERVAL', 60))
+HISTORY_BACKFILL_POINTS = int(os.getenv('RATES_HISTORY_BACKFILL_POINTS', 60))
+# Порт HTTP/WebSocket сервера
+PORT = int(os.getenv('PORT', 8888))
+# Шина между процессами (redis://... или unix:///path.sock) для режима --workers
+RATES_BUS = os.getenv('RATES_BUS', 'unix:///tmp/lr6-rates.sock')
+# Как часто воркер сообщает свое число наблюдателей и сколько оно считается актуальным
+OBSERVER_REPORT_INTERVAL = float(os.getenv('OBSERVER_REPORT_INTERVAL', 5))
+OBSERVER_REPORT_TTL = 3 * OBSERVER_REPORT_INTERVAL
+# permessage-deflate: включение (по умолчанию выключено: сжатие с общим
+# контекстом держит zlib-буферы на каждое соединение), уровень и mem_level zlib
+WS_COMPRESSION = os.getenv('WS_COMPRESSION', '0') == '1'
+WS_COMPRESSION_LEVEL = int(os.getenv('WS_COMPRESSION_LEVEL', 6))
+WS_COMPRESSION_MEM_LEVEL = int(os.getenv('WS_COMPRESSION_MEM_LEVEL', 8))
+# Пинги от сервера: период и сколько ждать ответа, прежде чем закрыть соединение.
+# Tornado ждет pong не дольше периода пингов, поэтому таймаут не больше периода
+WS_PING_INTERVAL = float(os.getenv('WS_PING_INTERVAL', 30))
+WS_PING_TIMEOUT = float(os.getenv('WS_PING_TIMEOUT', 10))
+# Соединение без сообщений и pong дольше этого времени закрывается (0 - не следить)
+WS_IDLE_TIMEOUT = float(os.getenv('WS_IDLE_TIMEOUT', 180))
+# Ограничения памяти на соединение: входящее сообщение и буфер записи, байты
+WS_MAX_MESSAGE_SIZE = int(os.getenv('WS_MAX_MESSAGE_SIZE', 64 * 1024))
+WS_MAX_WRITE_BUFFER = int(os.getenv('WS_MAX_WRITE_BUFFER', 1024 * 1024))
+# Максимум одновременных соединений процесса (0 - без ограничения)
+WS_MAX_CONNECTIONS = int(os.getenv('WS_MAX_CONNECTIONS', 10000))
+# Интервал, за который изменения числа наблюдателей схлопываются в одну рассылку
+OBSERVER_COUNT_INTERVAL = float(os.getenv('OBSERVER_COUNT_INTERVAL', 0.25))
+
+# Период проверки задержки цикла событий, секунды
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', 0.5))
+
+logger = logging.getLogger('lr6')
+
+# Метрики процесса для /metrics (у каждого воркера свои)
+METRICS = Registry()
+clients_gauge = METRICS.gauge('lr6_clients', 'Connected WebSocket clients',
+                              lambda: len(WebSocketHandler.clients))
+observers_gauge = METRICS.gauge('lr6_observers', 'Observers across all workers',
+                                lambda: observer_count())
+queue_depth = METRICS.distribution('lr6_client_queue_depth', 'Unsent frames per client',
+                                   lambda: (client.pending_frames + len(client.coalesced)
+                                            for client in WebSocketHandler.clients),
+                                   buckets=(0, 1, 2, 4, 8, 16))
+messages_sent = METRICS.counter('lr6_messages_sent_total', 'WebSocket messages written to clients')
+bytes_sent = METRICS.counter('lr6_bytes_sent_total', 'WebSocket bytes written to clients')
+frames_coalesced = METRICS.counter('lr6_frames_coalesced_total', 'Frames replaced by a newer frame of the same kind')
+clients_dropped = METRICS.counter('lr6_clients_dropped_total', 'Clients closed as slow or idle')
+connections_rejected = METRICS.counter('lr6_connections_rejected_total', 'Handshakes refused by the connection cap')
+broadcast_duration = METRICS.histogram('lr6_broadcast_duration_seconds', 'Fan-out of one rate update to local clients')
+fetch_duration = METRICS.histogram('lr6_upstream_fetch_duration_seconds', 'Rate source request latency')
+fetch_errors = METRICS.counter('lr6_upstream_fetch_errors_total', 'Failed rate source requests')
+fetch_not_modified = METRICS.counter('lr6_upstream_not_modified_total', 'Rate source responses without changes')
+loop_lag = METRICS.histogram('lr6_event_loop_lag_seconds', 'Event loop scheduling delay')
+
+
+# Подпротоколы WebSocket: JSON (по умолчанию) и двоичный формат курсов
+SUBPROTOCOL_JSON = 'rates.v1.json'
+SUBPROTOCOL_BINARY = 'rates.v1.bin'
+
+# Двоичный формат: заголовок и записи (код валюты, курс float64), network byte order
+BINARY_HEADER = struct.Struct('!BIIIdH')  # тип, seq, prev_seq, наблюдатели, время, число валют
+BINARY_RATE = struct.Struct('!3sd')
+BINARY_TYPES = {'currency_rates': 1, 'rates_snapshot': 2, 'rates_delta': 3}
+BINARY_NO_OBSERVERS = 0xFFFFFFFF
+
+
+def encode_binary(message):
+    """Сообщение с курсами в двоичном формате; None, если тип не поддерживается"""
+    message_type = BINARY_TYPES.get(message.get('type'))
+    if message_type is None:
+        return None
+    rates = message['rates']
+    timestamp = message.get('timestamp')
+    parts = [BINARY_HEADER.pack(
+        message_type,
+        message.get('seq', 0),
+        message.get('prev_seq', 0),
+        message.get('observer_count', BINARY_NO_OBSERVERS),
+        datetime.datetime.fromisoformat(timestamp).timestamp() if timestamp else 0.0,
+        len(rates)
+    )]
+    for code, rate in rates.items():
+        parts.append(BINARY_RATE.pack(code.encode('ascii'), rate))
+    return b''.join(parts)
+
+
+def frame_header(opcode, length, flags=0):
+    """Заголовок WebSocket-кадра сервера (RFC 6455, без маски)"""
+    first = 0x80 | flags | opcode
+    if length < 126:
+        return struct.pack('!BB', first, length)
+    if length <= 0xFFFF:
+        return struct.pack('!BBH', first, 126, length)
+    return struct.pack('!BBQ', first, 127, length)
+
+
+def deflate_offer(header):
+    """Параметры первого предложения permessage-deflate из Sec-WebSocket-Extensions.
+
+    Tornado принимает именно его и возвращает клиенту те же параметры.
+    None - клиент сжатие не предлагал."""
+    for extension in (header or '').split(','):
+        name, *params = [part.strip() for part in extension.split(';')]
+        if name != 'permessage-deflate':
+            continue
+        offer = {}
+        for param in params:
+            key, _, value = param.partition('=')
+            offer[key.strip()] = value.strip().strip('"') or None
+        return offer
+    return None
+
+
+def negotiated_deflate(header):
+    """(сжатие включено, ключ общего кадра) для рукопожатия клиента.
+
+    При server_no_context_takeover сервер сжимает каждое сообщение
+    независимо, результат одинаков для всех таких клиентов и вычисляется
+    один раз; ключ - (max_wbits, уровень, mem_level). Иначе ключ None."""
+    offer = deflate_offer(header) if WS_COMPRESSION else None
+    if offer is None:
+        return False, None
+    if 'server_no_context_takeover' not in offer:
+        return True, None
+    max_wbits = int(offer.get('server_max_window_bits') or zlib.MAX_WBITS)
+    return True, (max_wbits, WS_COMPRESSION_LEVEL, WS_COMPRESSION_MEM_LEVEL)
+
+
+class PreparedFrame:
+    """Сообщение, сериализованное один раз для рассылки всем клиентам.
+
+    Сообщение кодируется сразу (словарь курсов потом меняется), а сжатие
+    и сборка кадра для каждого варианта выполняются лениво и кэшируются."""
+    __slots__ = ('kind', '_payloads', '_wires')
+
+    def __init__(self, message, kind=None):
+        # Кадры одного вида (kind) взаимозаменяемы: медленному клиенту
+        # достаточно отправить самый свежий из них
+        self.kind = kind
+        text = (json.dumps(message).encode('utf-8'), False)
+        data = encode_binary(message)
+        self._payloads = {None: text, SUBPROTOCOL_JSON: text,
+                          SUBPROTOCOL_BINARY: text if data is None else (data, True)}
+        self._wires = {}
+
+    def payload(self, encoding=None):
+        """(данные, binary) для подпротокола клиента"""
+        return self._payloads[encoding]
+
+    def wire(self, encoding=None, deflate_key=None):
+        """Готовый WebSocket-кадр, при необходимости сжатый permessage-deflate"""
+        key = (encoding, deflate_key)
+        wire = self._wires.get(key)
+        if wire is None:
+            data, binary = self.payload(encoding)
+            flags = 0
+            if deflate_key is not None:
+                max_wbits, level, mem_level = deflate_key
+                compressor = zlib.compressobj(level, zlib.DEFLATED, -max_wbits, mem_level)
+                data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                data = data[:-4]  # RFC 7692: хвост 00 00 ff ff не передается
+                flags = 0x40  # RSV1
+            wire = frame_header(0x2 if binary else 0x1, len(data), flags) + data
+            self._wires[key] = wire
+        return wire
 
 
 class WebSocketHandler(tornado.websocket.WebSocketHandler):
     clients = set()
+    # Клиенты без подписок получают все валюты
+    unfiltered_clients = set()
+    # Индекс подписок: валюта -> клиенты, подписанные на нее
+    subscribers = {}
+    # Открытые соединения, включая те, которым уже не удалась запись
+    connection_count = 0
+
+    async def get(self, *args, **kwargs):
+        # При перегрузке отказываем до рукопожатия: клиент получит 503
+        # и переподключится позже, а работающие соединения не пострадают
+        if WS_MAX_CONNECTIONS and WebSocketHandler.connection_count >= WS_MAX_CONNECTIONS:
+            logger.warning("⛔ Достигнут предел соединений, новое соединение отклонено")
+            connections_rejected.inc()
+            self.set_status(503)
+            self.set_header('Retry-After', '5')
+            self.finish('Too many connections')
+            return
+        await super().get(*args, **kwargs)
 
     def open(self):
-        print("🔌 WebSocket подключен")
+        logger.debug("🔌 WebSocket подключен")
+        WebSocketHandler.connection_count += 1
+        self.last_activity = time.monotonic()
+        # Буфер записи ограничен: переполнение означает, что клиент не читает
+        self.ws_connection.stream.max_write_buffer_size = WS_MAX_WRITE_BUFFER
+        # Согласованное с клиентом сжатие
+        self.compressed, self.deflate_key = negotiated_deflate(
+            self.request.headers.get('Sec-WebSocket-Extensions'))
+        # Состояние исходящей очереди клиента
+        self.pending_frames = 0
+        self.coalesced = {}
+        self.slow_since = None
+        # 'full' - полный набор курсов на каждом цикле (старые клиенты),
+        # 'delta' - только изменившиеся валюты с номером последовательности
+        self.protocol = self.get_argument('protocol', 'full')
+        # Подписки на валюты: None - все валюты, иначе frozenset кодов
+        self.currencies = None
+        # Подписки на кросс-курсы: frozenset пар (base, quote)
+        self.cross_pairs = frozenset()
         WebSocketHandler.clients.add(self)
-        # Отправляем текущие курсы сразу при подключении
+        WebSocketHandler.unfiltered_clients.add(self)
+        # Отправляем текущие курсы и недавнюю историю сразу при подключении
         self.send_current_rates()
+        self.send_frame(history_backfill_frame())
         # Обновляем счетчик наблюдателей у всех клиентов
         self.update_observer_count()
 
     def on_close(self):
-        print("🔌 WebSocket отключен")
+        logger.debug("🔌 WebSocket отключен")
+        WebSocketHandler.connection_count -= 1
         WebSocketHandler.clients.discard(self)
+        self.set_currencies(None)
+        WebSocketHandler.unfiltered_clients.discard(self)
         # Обновляем счетчик наблюдателей у оставшихся клиентов
         self.update_observer_count()
 
+    def on_pong(self, data):
+        self.last_activity = time.monotonic()
+
     def on_message(self, message):
+        self.last_activity = time.monotonic()
         try:
             data = json.loads(message)
             if data.get('type') == 'ping':
                 self.write_message(json.dumps({'type': 'pong'}))
+            elif data.get('type') == 'resync':
+                # Клиент заметил пропуск в последовательности дельт
+                self.send_current_rates()
+            elif data.get('type') in ('subscribe', 'unsubscribe'):
+                self.update_subscription(data)
+            elif data.get('type') in ('subscribe_cross', 'unsubscribe_cross'):
+                self.update_cross_subscription(data)
         except:
             pass
 
+    def update_subscription(self, data):
+        """Подписка на валюты: {"type": "subscribe", "currencies": ["USD", "EUR"]}"""
+        requested = {str(code).upper() for code in data.get('currencies', [])}
+        current = self.currencies or frozenset()
+        if data['type'] == 'subscribe':
+            self.set_currencies(current | requested)
+        else:
+            self.set_currencies(current - requested)
+        # Снимок задает новую точку отсчета seq для этого набора валют
+        self.send_current_rates()
+
+    def set_currencies(self, currencies):
+        """Обновление подписок клиента и индекса подписчиков"""
+        subscribers = WebSocketHandler.subscribers
+        for code in self.currencies or ():
+            clients = subscribers.get(code)
+            if clients is not None:
+                clients.discard(self)
+                if not clients:
+                    del subscribers[code]
+        self.currencies = None if currencies is None else frozenset(currencies)
+        if self.currencies is None:
+            WebSocketHandler.unfiltered_clients.add(self)
+            return
+        WebSocketHandler.unfiltered_clients.discard(self)
+        for code in self.currencies:
+            subscribers.setdefault(code, set()).add(self)
+
+    def update_cross_subscription(self, data):
+        """Подписка на кросс-курсы: {"type": "subscribe_cross", "pairs": ["USD/EUR"]}"""
+        try:
+            pairs = {parse_pair(pair) for pair in data.get('pairs', [])}
+        except (ValueError, AttributeError) as e:
+            self.write_message(json.dumps({'type': 'error', 'message': str(e)}))
+            return
+        if data['type'] == 'subscribe_cross':
+            self.cross_pairs = self.cross_pairs | pairs
+            self.send_frame(PreparedFrame(cross_rates_message(pairs), kind='cross_rates'))
+        else:
+            self.cross_pairs = self.cross_pairs - pairs
+
     def send_current_rates(self):
         """Отправка текущих курсов клиенту"""
         data = {
-            'type': 'currency_rates',
-            'rates': currency_rates,
+            'type': 'rates_snapshot' if self.protocol == 'delta' else 'currency_rates',
+            'seq': last_seq(self.currencies),
+            'rates': select_rates(currency_rates, self.currencies),
             'timestamp': datetime.datetime.now().isoformat(),
-            'observer_count': len(WebSocketHandler.clients)
+            'observer_count': observer_count()
         }
-        try:
-            self.write_message(json.dumps(data))
-            print(f"📤 Отправлены курсы. Наблюдателей: {len(WebSocketHandler.clients)}")
-        except Exception as e:
-            print(f"❌ Ошибка отправки: {e}")
+        self.send_frame(PreparedFrame(data, kind='rates'))
 
     def update_observer_count(self):
-        """Рассылка обновленного количества наблюдателей всем клиентам"""
-        count = len(WebSocketHandler.clients)
+        """Планирование рассылки обновленного количества наблюдателей"""
+        observer_count_notifier.notify()
+
+    def send_frame(self, frame):
+        """Отправка подготовленного кадра с ограничением очереди клиента.
+
+        Пока у клиента не больше MAX_PENDING_FRAMES неотправленных кадров,
+        кадр уходит сразу. Иначе он откладывается, вытесняя более старый
+        кадр того же вида, а клиент, не успевающий дольше
+        SLOW_CLIENT_TIMEOUT секунд, отключается."""
+        if self.pending_frames < MAX_PENDING_FRAMES:
+            self._write_frame(frame)
+            return True
+
+        now = time.monotonic()
+        if self.slow_since is None:
+            self.slow_since = now
+        elif now - self.slow_since > SLOW_CLIENT_TIMEOUT:
+            logger.info("🐢 Клиент не успевает получать данные, отключаем")
+            clients_dropped.inc()
+            WebSocketHandler.clients.discard(self)
+            self.close(1008, 'client too slow')
+            return False
+
+        if frame.kind is not None:
+            if self.coalesced.pop(frame.kind, None) is not None:
+                frames_coalesced.inc()
+            self.coalesced[frame.kind] = frame
+        return False
+
+    def _write_frame(self, frame):
+        conn = self.ws_connection
+        if conn is None or conn.is_closing():
+            WebSocketHandler.clients.discard(self)
+            return
+        encoding = self.selected_subprotocol
+        try:
+            if not self.compressed or self.deflate_key is not None:
+                # Без сжатия или с независимым сжатием сообщений кадр одинаков
+                # для всех таких клиентов: пишем заранее собранные байты в поток
+                wire = frame.wire(encoding, self.deflate_key)
+                future = conn.stream.write(wire)
+                size = len(wire)
+            else:
+                # Сжатие с общим контекстом - у каждого соединения свое
+                data, binary = frame.payload(encoding)
+                future = self.write_message(data, binary=binary)
+                size = len(data)
+        except (tornado.iostream.StreamClosedError,
+                tornado.websocket.WebSocketClosedError):
+            WebSocketHandler.clients.discard(self)
+            return
+        except tornado.iostream.StreamBufferFullError:
+            logger.info("🐢 Буфер записи клиента переполнен, отключаем")
+            clients_dropped.inc()
+            WebSocketHandler.clients.discard(self)
+            self.close(1008, 'client too slow')
+            return
+        messages_sent.inc()
+        bytes_sent.inc(size)
+        self.pending_frames += 1
+        future.add_done_callback(self._on_frame_written)
+
+    def _on_frame_written(self, future):
+        self.pending_frames -= 1
+        if future.exception() is not None:
+            WebSocketHandler.clients.discard(self)
+            return
+        if self.pending_frames == 0:
+            self.slow_since = None
+        if self.coalesced and self.pending_frames < MAX_PENDING_FRAMES:
+            kind = next(iter(self.coalesced))
+            self._write_frame(self.coalesced.pop(kind))
+
+    def check_origin(self, origin):
+        return True
+
+    def select_subprotocol(self, subprotocols):
+        """Двоичный формат курсов включается клиентом через подпротокол"""
+        for subprotocol in (SUBPROTOCOL_BINARY, SUBPROTOCOL_JSON):
+            if subprotocol in subprotocols:
+                return subprotocol
+        return None
+
+    def get_compression_options(self):
+        if not WS_COMPRESSION:
+            return None
+        return {
+            'compression_level': WS_COMPRESSION_LEVEL,
+            'mem_level': WS_COMPRESSION_MEM_LEVEL
+        }
+
+
+def reap_idle_clients():
+    """Закрытие соединений, от которых давно ничего не приходило.
+
+    Браузер отвечает на пинги сервера, поэтому живой клиент не бывает
+    бездействующим; полуоткрытые TCP-соединения так не копятся."""
+    deadline = time.monotonic() - WS_IDLE_TIMEOUT
+    idle = [client for client in WebSocketHandler.clients if client.last_activity < deadline]
+    for client in idle:
+        WebSocketHandler.clients.discard(client)
+        client.close(1001, 'idle timeout')
+    if idle:
+        logger.info("💤 Закрыто бездействующих соединений: %d", len(idle))
+        clients_dropped.inc(len(idle))
+
+
+def start_idle_reaper():
+    if WS_IDLE_TIMEOUT > 0:
+        interval = min(WS_IDLE_TIMEOUT / 4, 30)
+        tornado.ioloop.PeriodicCallback(reap_idle_clients, interval * 1000).start()
+
+
+def broadcast(frame, clients=None, **by_protocol):
+    """Рассылка подготовленного кадра клиентам (по умолчанию всем).
+
+    by_protocol задает отдельный кадр для клиентов с указанным протоколом
+    (None - ничего им не отправлять)."""
+    for client in list(WebSocketHandler.clients if clients is None else clients):
+        client_frame = by_protocol.get(client.protocol, frame)
+        if client_frame is not None:
+            client.send_frame(client_frame)
+
+
+class ObserverCountNotifier:
+    """Схлопывает изменения числа наблюдателей в одну рассылку за интервал.
+
+    При массовом переподключении клиентов вместо O(N^2) сообщений
+    уходит одна рассылка на интервал, и только если число изменилось."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.last_count = None
+        self._scheduled = False
+
+    def notify(self):
+        if self._scheduled:
+            return
+        self._scheduled = True
+        tornado.ioloop.IOLoop.current().call_later(self.interval, self.flush)
+
+    def flush(self):
+        self._scheduled = False
+        if rates_bus is not None:
+            report_observer_count()
+        count = observer_count()
+        if count == self.last_count:
+            return
+        self.last_count = count
         data = {
             'type': 'observer_count',
             'count': count
         }
-        for client in WebSocketHandler.clients.copy():
-            try:
-                client.write_message(json.dumps(data))
-            except Exception as e:
-                print(f"❌ Ошибка отправки счетчика: {e}")
-                WebSocketHandler.clients.discard(client)
+        broadcast(PreparedFrame(data, kind='observer_count'))
 
-    def check_origin(self, origin):
-        return True
+
+observer_count_notifier = ObserverCountNotifier(OBSERVER_COUNT_INTERVAL)
+
+# Шина pub/sub, если процесс работает воркером в многопроцессном режиме
+rates_bus = None
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+# Наблюдатели других воркеров: worker_id -> (число, время получения)
+remote_observer_counts = {}
+
+
+def observer_count():
+    """Число наблюдателей во всех процессах"""
+    total = len(WebSocketHandler.clients)
+    now = time.monotonic()
+    for worker_id, (count, received_at) in list(remote_observer_counts.items()):
+        if now - received_at > OBSERVER_REPORT_TTL:
+            # Воркер перестал отчитываться - считаем, что он завершился
+            del remote_observer_counts[worker_id]
+        elif worker_id != WORKER_ID:
+            total += count
+    return total
+
+
+def report_observer_count():
+    message = {'worker': WORKER_ID, 'count': len(WebSocketHandler.clients)}
+    future = asyncio.ensure_future(rates_bus.publish('observers', message))
+    # Обрыв шины обрабатывается в run_worker, здесь ошибку только забираем
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
 
 
 class MainHandler(tornado.web.RequestHandler):
@@ -72,6 +528,80 @@ class MainHandler(tornado.web.RequestHandler):
         self.render("templates/index.html")
 
 
+class MetricsHandler(tornado.web.RequestHandler):
+    """Метрики процесса в текстовом формате Prometheus"""
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(METRICS.render())
+
+
+async def monitor_event_loop_lag(interval=LOOP_LAG_INTERVAL):
+    """Задержка цикла событий: насколько позже срока просыпается sleep"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        loop_lag.observe(max(loop.time() - started - interval, 0.0))
+
+
+def parse_time(value):
+    """Время из запроса: unix-секунды или ISO 8601"""
+    if value is None:
+        return None
+    try:
+        t = float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    if not math.isfinite(t):
+        raise ValueError("time must be a finite number")
+    return t
+
+
+class CrossRatesHandler(tornado.web.RequestHandler):
+    """GET /rates/cross?base=USD&quote=EUR или /rates/cross?base=USD (вся строка)"""
+
+    def get(self):
+        base = self.get_argument('base', None)
+        quote = self.get_argument('quote', None)
+        if base is None:
+            self.write({'codes': cross_rates.codes})
+            return
+        base = base.upper()
+        if quote is None:
+            row = cross_rates.row(base)
+            if row is None:
+                raise tornado.web.HTTPError(404, reason=f"unknown currency {base}")
+            self.write({'base': base, 'rates': row})
+            return
+        quote = quote.upper()
+        rate = cross_rates.rate(base, quote)
+        if rate is None:
+            raise tornado.web.HTTPError(404, reason=f"no rate for {base}/{quote}")
+        self.write({'base': base, 'quote': quote, 'rate': rate})
+
+
+class HistoryHandler(tornado.web.RequestHandler):
+    """GET /history?currency=USD&from=&to=&step=minute"""
+
+    def get(self):
+        currency = self.get_argument('currency').upper()
+        step = self.get_argument('step', None)
+        try:
+            t_from = parse_time(self.get_argument('from', None))
+            t_to = parse_time(self.get_argument('to', None))
+            if step is not None and step not in rate_history.levels:
+                step = float(step)
+                if not math.isfinite(step) or step <= 0:
+                    raise ValueError("step must be a positive number")
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, reason=str(e))
+        self.write({
+            'currency': currency,
+            'points': rate_history.query(currency, t_from, t_to, step)
+        })
+
+
 # Глобальные курсы валют
 currency_rates = {
     'USD': 0.0,
@@ -80,62 +610,275 @@ currency_rates = {
     'CNY': 0.0,
     'JPY': 0.0
 }
+# Номер последнего изменения курсов для протокола 'delta'
+rates_seq = 0
+# Валюта -> seq, в котором она менялась последний раз
+currency_seq = {}
+# Матрица кросс-курсов всех валют
+cross_rates = CrossRates()
+# История изменений курсов
+rate_history = RateHistory()
+_backfill_cache = (None, None)
+
+
+def history_backfill_frame():
+    """Недавняя история для нового клиента; кодируется один раз на версию истории"""
+    global _backfill_cache
+    version, frame = _backfill_cache
+    if version != rate_history.version:
+        frame = PreparedFrame({
+            'type': 'history',
+            'step': 'minute',
+            'series': rate_history.tail(HISTORY_BACKFILL_POINTS)
+        }, kind='history')
+        _backfill_cache = (rate_history.version, frame)
+    return frame
+
+
+def select_rates(rates, currencies):
+    if currencies is None:
+        return rates
+    return {code: rates[code] for code in currencies if code in rates}
 
 
-async def fetch_currency_rates():
-    """Получение курсов валют с API ЦБ"""
+def last_seq(currencies):
+    """seq последнего изменения, касающегося набора валют (None - всех)"""
+    if currencies is None:
+        return rates_seq
+    return max((currency_seq.get(code, 0) for code in currencies), default=0)
+
+
+def cross_rates_message(pairs):
+    return {
+        'type': 'cross_rates',
+        'seq': rates_seq,
+        'rates': cross_rates.pairs(sorted(pairs))
+    }
+
+
+def broadcast_cross_rates():
+    """Рассылка кросс-курсов подписчикам: один кадр на одинаковый набор пар"""
+    frames = {}
+    for client in list(WebSocketHandler.clients):
+        if not client.cross_pairs:
+            continue
+        frame = frames.get(client.cross_pairs)
+        if frame is None:
+            frame = PreparedFrame(cross_rates_message(client.cross_pairs), kind='cross_rates')
+            frames[client.cross_pairs] = frame
+        client.send_frame(frame)
+
+
+async def save_history_periodically():
+    """Периодическое сохранение истории в файл, если она менялась"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(HISTORY_SAVE_INTERVAL)
+        if rate_history.version == rate_history.saved_version:
+            continue
+        # Копию снимаем в цикле событий, а пишем на диск в отдельном потоке
+        version, records = rate_history.snapshot()
+        try:
+            await loop.run_in_executor(None, RateHistory.write, HISTORY_FILE, records)
+            rate_history.saved_version = version
+        except OSError as e:
+            logger.error("❌ Не удалось сохранить историю: %s", e)
+
+
+def load_history():
+    """История из файла; с поврежденным файлом начинаем с пустой историей"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(CBR_API_URL) as response:
-                if response.status == 200:
-                    text = await response.text()
-                    data = json.loads(text)
+        if rate_history.load(HISTORY_FILE):
+            logger.info("📈 История курсов загружена из %s", HISTORY_FILE)
+    except (ValueError, EOFError) as e:
+        logger.error("❌ Не удалось загрузить историю, начинаем с пустой: %s", e)
+
 
-                    rates = {}
-                    currencies = ['USD', 'EUR', 'GBP', 'CNY', 'JPY']
+class RateSource:
+    """Клиент источника курсов с постоянным пулом соединений.
 
-                    for currency in currencies:
-                        if currency in data.get('Valute', {}):
-                            rates[currency] = data['Valute'][currency]['Value']
+    Сессия aiohttp создается один раз, поэтому TCP/TLS-соединение
+    переиспользуется между опросами. Запросы условные (ETag и
+    If-Modified-Since): если данные не изменились, ответ не скачивается
+    и не разбирается заново."""
 
-                    print(f"✅ Получены курсы: {rates}")
-                    return rates
+    def __init__(self, url=CBR_API_URL, timeout=FETCH_TIMEOUT):
+        self.url = url
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=timeout / 2)
+        self.session = None
+        self.etag = None
+        self.last_modified = None
+        self.body_hash = None
+        self.rates = None
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=2, keepalive_timeout=MAX_POLL_INTERVAL + 30)
+            self.session = aiohttp.ClientSession(timeout=self.timeout, connector=connector)
+        return self.session
+
+    async def fetch(self):
+        """Получение курсов валют с API ЦБ.
+
+        Возвращает (rates, modified); при ошибке - (None, False)."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        started = time.perf_counter()
+        try:
+            async with self._get_session().get(self.url, headers=headers) as response:
+                fetch_duration.observe(time.perf_counter() - started)
+                if response.status == 304:
+                    fetch_not_modified.inc()
+                    return self.rates, False
+                if response.status != 200:
+                    logger.warning("❌ Ошибка API: %s", response.status)
+                    fetch_errors.inc()
+                    return None, False
+
+                body = await response.read()
+                self.etag = response.headers.get('ETag')
+                self.last_modified = response.headers.get('Last-Modified')
+                # Сервер мог проигнорировать условный запрос - сравниваем тело
+                body_hash = hashlib.sha1(body).digest()
+                if body_hash == self.body_hash and self.rates is not None:
+                    fetch_not_modified.inc()
+                    return self.rates, False
+                self.body_hash = body_hash
+                self.rates = self.parse(json.loads(body))
+                logger.info("✅ Получены курсы: %d валют", len(self.rates))
+                return self.rates, True
+        except Exception as e:
+            logger.warning("❌ Ошибка запроса: %r", e)
+            fetch_errors.inc()
+            return None, False
+
+    @staticmethod
+    def parse(data):
+        """Курсы всех валют из Valute в рублях за одну единицу валюты"""
+        rates = {}
+        for currency, valute in data.get('Valute', {}).items():
+            # ЦБ публикует курс за Nominal единиц (например, за 100 иен)
+            rates[currency] = valute['Value'] / (valute.get('Nominal') or 1)
+        return rates
+
+
+def publish_rates(new_rates):
+    """Применение новых курсов и рассылка клиентам.
+
+    Клиенты протокола 'full' получают весь набор курсов, клиенты 'delta' -
+    только изменившиеся валюты со следующим seq или heartbeat, если
+    ничего не изменилось. Клиенты с подписками получают только свои валюты
+    и только при их изменении; prev_seq в дельте - seq предыдущего
+    изменения их набора валют, по нему клиент замечает пропуски."""
+    global rates_seq
+
+    changed = {currency: rate for currency, rate in new_rates.items()
+               if currency_rates.get(currency) != rate}
+    timestamp = datetime.datetime.now().isoformat()
+    prev_seq = rates_seq
+    if changed:
+        currency_rates.update(changed)
+        rate_history.record(time.time(), changed)
+        cross_rates.update(changed)
+        rates_seq += 1
+        delta_frame = PreparedFrame({
+            'type': 'rates_delta',
+            'seq': rates_seq,
+            'prev_seq': prev_seq,
+            'rates': changed,
+            'timestamp': timestamp
+        }, kind='rates')
+    else:
+        delta_frame = PreparedFrame({'type': 'heartbeat', 'seq': rates_seq}, kind='heartbeat')
+
+    # JSON кодируется один раз на протокол, а не на клиента
+    full_frame = PreparedFrame({
+        'type': 'currency_rates',
+        'seq': rates_seq,
+        'rates': currency_rates,
+        'timestamp': timestamp,
+        'observer_count': observer_count()
+    }, kind='rates')
+    broadcast(full_frame, WebSocketHandler.unfiltered_clients, delta=delta_frame)
+    if changed:
+        publish_to_subscribers(changed, timestamp)
+        for currency in changed:
+            currency_seq[currency] = rates_seq
+        broadcast_cross_rates()
+    return changed
+
+
+def publish_to_subscribers(changed, timestamp):
+    """Рассылка изменений клиентам с подписками.
+
+    Через индекс подписчиков затрагиваются только клиенты, подписанные на
+    изменившиеся валюты; кадр кодируется один раз на набор подписок."""
+    groups = {}
+    for currency in changed:
+        for client in WebSocketHandler.subscribers.get(currency, ()):
+            groups.setdefault(client.currencies, set()).add(client)
+
+    for currencies, clients in groups.items():
+        frames = {}
+        for client in clients:
+            frame = frames.get(client.protocol)
+            if frame is None:
+                if client.protocol == 'delta':
+                    frame = PreparedFrame({
+                        'type': 'rates_delta',
+                        'seq': rates_seq,
+                        'prev_seq': last_seq(currencies),
+                        'rates': select_rates(changed, currencies),
+                        'timestamp': timestamp
+                    }, kind='rates')
                 else:
-                    print(f"❌ Ошибка API: {response.status}")
-                    return None
-    except Exception as e:
-        print(f"❌ Ошибка запроса: {e}")
-        return None
+                    frame = PreparedFrame({
+                        'type': 'currency_rates',
+                        'seq': rates_seq,
+                        'rates': select_rates(currency_rates, currencies),
+                        'timestamp': timestamp,
+                        'observer_count': observer_count()
+                    }, kind='rates')
+                frames[client.protocol] = frame
+            client.send_frame(frame)
+
 
+def publish_and_report(new_rates):
+    started = time.perf_counter()
+    changed = publish_rates(new_rates)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    broadcast_duration.observe(elapsed_ms / 1000)
+    logger.debug("📤 Курсы разосланы %d наблюдателям за %.1f мс, изменилось валют: %d",
+                 len(WebSocketHandler.clients), elapsed_ms, len(changed))
 
-async def update_rates():
-    """Обновление курсов и рассылка клиентам"""
-    global currency_rates
 
+async def update_rates(source, publish=None):
+    """Обновление курсов и рассылка клиентам.
+
+    publish - корутина для отправки курсов в шину (процесс-опросчик);
+    по умолчанию курсы рассылаются клиентам этого процесса."""
+    interval = POLL_INTERVAL
+    published = False
     while True:
-        print("🔄 Обновление курсов...")
-        new_rates = await fetch_currency_rates()
-
-        if new_rates:
-            currency_rates.update(new_rates)
-            print(f"📊 Новые курсы: {currency_rates}")
-
-            # Рассылаем всем подключенным клиентам
-            data = {
-                'type': 'currency_rates',
-                'rates': currency_rates,
-                'timestamp': datetime.datetime.now().isoformat(),
-                'observer_count': len(WebSocketHandler.clients)
-            }
+        logger.debug("🔄 Обновление курсов...")
+        new_rates, modified = await source.fetch()
 
-            for client in WebSocketHandler.clients.copy():
-                try:
-                    client.write_message(json.dumps(data))
-                    print(f"📤 Отправлено клиенту. Всего наблюдателей: {len(WebSocketHandler.clients)}")
-                except Exception as e:
-                    print(f"❌ Ошибка отправки клиенту: {e}")
-                    WebSocketHandler.clients.discard(client)
+        if modified:
+            interval = POLL_INTERVAL
+            logger.debug("📊 Новые курсы: %s", new_rates)
         else:
+            # Данные не меняются или источник недоступен - опрашиваем реже
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+        if new_rates is None and not published:
             # Тестовые данные если API не доступно
             test_rates = {
                 'USD': 75.50,
@@ -144,44 +887,246 @@ async def update_rates():
                 'CNY': 10.45,
                 'JPY': 0.65
             }
-            currency_rates.update(test_rates)
-            print(f"📊 Тестовые курсы: {currency_rates}")
-
-            data = {
-                'type': 'currency_rates',
-                'rates': currency_rates,
-                'timestamp': datetime.datetime.now().isoformat(),
-                'observer_count': len(WebSocketHandler.clients)
-            }
+            new_rates = test_rates
+            logger.warning("📊 Источник недоступен, тестовые курсы: %s", new_rates)
 
-            for client in WebSocketHandler.clients.copy():
-                try:
-                    client.write_message(json.dumps(data))
-                except:
-                    WebSocketHandler.clients.discard(client)
+        if new_rates is not None:
+            published = True
+            if publish is None:
+                publish_and_report(new_rates)
+            else:
+                await publish(new_rates)
 
-        await asyncio.sleep(30)  # Обновление каждые 30 секунд
+        await asyncio.sleep(interval)
 
 
 def make_app():
     return tornado.web.Application([
         (r"/", MainHandler),
         (r"/websocket", WebSocketHandler),
+        (r"/history", HistoryHandler),
+        (r"/rates/cross", CrossRatesHandler),
+        (r"/metrics", MetricsHandler),
     ],
-        template_path=os.path.join(os.path.dirname(__file__), ""))
+        template_path=os.path.join(os.path.dirname(__file__), ""),
+        websocket_ping_interval=WS_PING_INTERVAL or None,
+        websocket_ping_timeout=WS_PING_TIMEOUT or None,
+        websocket_max_message_size=WS_MAX_MESSAGE_SIZE)
+
+
+async def connect_bus(url):
+    """Подключение к шине с повторными попытками"""
+    delay = 0.1
+    while True:
+        bus = make_bus(url)
+        try:
+            await bus.connect()
+            return bus
+        except (OSError, ConnectionError) as e:
+            logger.warning("⏳ Шина %s недоступна (%s), повтор через %.1f с", url, e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5)
+
+
+async def run_fetcher(bus_url):
+    """Единственный процесс, опрашивающий источник курсов и публикующий их в шину.
+
+    Опрос источника не зависит от шины: при потере соединения (например,
+    перезапуске Redis) опросчик переподключается, как воркеры, и сразу
+    повторяет последние курсы."""
+    source = RateSource(CBR_API_URL)
+    last_rates = {}
+    bus = None
+
+    async def publish(rates):
+        last_rates['rates'] = rates
+        if bus is None:
+            # Шина переподключается - курсы уйдут сразу после подключения
+            return
+        try:
+            await bus.publish('rates', {'rates': rates})
+        except (OSError, ConnectionError) as e:
+            logger.error("❌ Курсы не опубликованы: %s", e)
+
+    logger.info("📡 Опросчик курсов публикует в %s", bus_url)
+    poller = asyncio.create_task(update_rates(source, publish))
+    try:
+        while True:
+            bus = await connect_bus(bus_url)
+            try:
+                messages = await bus.listen(['control'])
+                if last_rates:
+                    await bus.publish('rates', {'rates': last_rates['rates']})
+                # Воркер, запущенный позже, просит последние курсы, не дожидаясь опроса
+                async for _, message in messages:
+                    if message.get('type') == 'rates_request' and last_rates:
+                        await bus.publish('rates', {'rates': last_rates['rates']})
+            except (OSError, ConnectionError) as e:
+                logger.error("❌ Потеряно соединение с шиной: %s", e)
+            finally:
+                closing, bus = bus, None
+                await closing.close()
+    finally:
+        poller.cancel()
+        await source.close()
+
+
+async def run_worker(bus_url, port, persist_history):
+    """Воркер: свои WebSocket-клиенты, курсы из шины, общий порт через SO_REUSEPORT"""
+    global rates_bus, WORKER_ID
+
+    # Процесс мог быть создан fork-ом: идентификатор берем по своему pid
+    WORKER_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+    load_history()
+
+    sockets = tornado.netutil.bind_sockets(port, reuse_port=True)
+    server = tornado.httpserver.HTTPServer(make_app())
+    server.add_sockets(sockets)
+    start_idle_reaper()
+    asyncio.create_task(monitor_event_loop_lag())
+    logger.info("🚀 Воркер %s принимает соединения на порту %d", WORKER_ID, port)
+
+    if persist_history:
+        asyncio.create_task(save_history_periodically())
+
+    async def report_periodically():
+        while True:
+            report_observer_count()
+            await asyncio.sleep(OBSERVER_REPORT_INTERVAL)
 
+    try:
+        while True:
+            rates_bus = await connect_bus(bus_url)
+            reporter = asyncio.create_task(report_periodically())
+            try:
+                # Сначала подписка, потом запрос: ответ опросчика не должен потеряться
+                messages = await rates_bus.listen(['rates', 'observers'])
+                await rates_bus.publish('control', {'type': 'rates_request'})
+                async for channel, message in messages:
+                    if channel == 'rates':
+                        publish_and_report(message['rates'])
+                    else:
+                        remote_observer_counts[message['worker']] = (message['count'], time.monotonic())
+                        observer_count_notifier.notify()
+            except (OSError, ConnectionError) as e:
+                logger.error("❌ Потеряно соединение с шиной: %s", e)
+            finally:
+                reporter.cancel()
+                await rates_bus.close()
+                rates_bus = None
+    finally:
+        if persist_history:
+            rate_history.save(HISTORY_FILE)
+
+
+def run_process(role, *args):
+    coroutine = run_fetcher if role == 'fetcher' else run_worker
+    # Поток вывода логов после fork не наследуется - запускаем свой
+    setup_logging()
+    # SIGTERM обрабатываем как Ctrl+C, чтобы отработали блоки finally
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(coroutine(*args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_logging()
+
+
+# Как часто launch() проверяет дочерние процессы
+SUPERVISE_INTERVAL = 1.0
+
+
+def launch(workers, bus_url, port):
+    """Запуск опросчика и N воркеров; для unix:// брокер работает в этом процессе.
+
+    Упавший дочерний процесс запускается заново: без опросчика воркеры
+    молча раздавали бы устаревшие курсы."""
+    specs = [('fetcher', ('fetcher', bus_url))]
+    for i in range(workers):
+        specs.append((f'worker-{i}', ('worker', bus_url, port, i == 0)))
+
+    def start(name, args):
+        process = multiprocessing.Process(target=run_process, args=args, name=name)
+        process.start()
+        return process
+
+    processes = [start(name, args) for name, args in specs]
+    # SIGTERM (docker stop) обрабатываем как Ctrl+C, чтобы остановить дочерние процессы
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    logger.info("🚀 Запущено воркеров: %d, порт %d, шина %s", workers, port, bus_url)
+
+    def stop_processes():
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+
+    async def broker():
+        broker = None
+        if bus_url.startswith('unix://'):
+            broker = await UnixSocketBroker(bus_url[len('unix://'):]).start()
+        try:
+            while True:
+                await asyncio.sleep(SUPERVISE_INTERVAL)
+                for i, (name, args) in enumerate(specs):
+                    if not processes[i].is_alive():
+                        logger.error("💥 Процесс %s завершился (код %s), перезапуск",
+                                     name, processes[i].exitcode)
+                        processes[i] = start(name, args)
+        finally:
+            # Сначала останавливаем процессы, затем шину, чтобы они не переподключались
+            stop_processes()
+            if broker is not None:
+                await broker.close()
+
+    try:
+        asyncio.run(broker())
+    except KeyboardInterrupt:
+        pass
+
+
+async def main(port=PORT):
+    load_history()
 
-async def main():
     app = make_app()
-    app.listen(8888)
-    print("🚀 Сервер запущен на http://localhost:8888")
+    app.listen(port)
+    start_idle_reaper()
+    asyncio.create_task(monitor_event_loop_lag())
+    logger.info("🚀 Сервер запущен на http://localhost:%d", port)
 
     # Запускаем обновление курсов в фоне
-    asyncio.create_task(update_rates())
+    source = RateSource(CBR_API_URL)
+    asyncio.create_task(update_rates(source))
+    asyncio.create_task(save_history_periodically())
 
     # Бесконечный цикл
-    await asyncio.Event().wait()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await source.close()
+        rate_history.save(HISTORY_FILE)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Currency rates WebSocket server')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=0,
+                        help='число процессов-воркеров (0 - один процесс, как раньше)')
+    parser.add_argument('--role', choices=['fetcher', 'worker'],
+                        help='запустить только одну роль (для запуска на разных хостах)')
+    parser.add_argument('--bus', default=RATES_BUS, help='redis://host:port/db или unix:///path.sock')
+    args = parser.parse_args()
+    if WS_PING_INTERVAL and WS_PING_TIMEOUT > WS_PING_INTERVAL:
+        parser.error(f'WS_PING_TIMEOUT ({WS_PING_TIMEOUT:g}) не может быть больше '
+                     f'WS_PING_INTERVAL ({WS_PING_INTERVAL:g})')
+
+    setup_logging()
+    if args.role:
+        run_process(args.role, *((args.bus,) if args.role == 'fetcher' else (args.bus, args.port, True)))
+    elif args.workers:
+        launch(args.workers, args.bus, args.port)
+    else:
+        asyncio.run(main(args.port))
@@ -0,0 +1,185 @@
+"""Метрики сервера курсов в текстовом формате Prometheus и настройка логирования.
+
+Счетчики и гистограммы обновляются в цикле событий без блокировок;
+значения, которые дешевле посчитать при запросе (число клиентов,
+глубина очередей), задаются функциями и вычисляются в момент /metrics.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from bisect import bisect_left
+
+# Уровень и формат логов: LOG_FORMAT=text или json (одна строка JSON на запись)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+
+# Границы гистограмм длительностей, секунды
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, '', self.value
+
+
+class Gauge:
+    """Значение, которое задается явно или вычисляется функцией при запросе"""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, function=None):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self.function = function
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        yield self.name, '', self.function() if self.function is not None else self.value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{self.name}_bucket', f'{{le="{bound}"}}', cumulative
+        yield f'{self.name}_bucket', '{le="+Inf"}', self.count
+        yield f'{self.name}_sum', '', self.sum
+        yield f'{self.name}_count', '', self.count
+
+
+class DistributionGauge(Histogram):
+    """Гистограмма текущего состояния: значения берутся функцией при каждом запросе"""
+
+    def __init__(self, name, help_text, function, buckets):
+        super().__init__(name, help_text, buckets)
+        self.function = function
+
+    def samples(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        for value in self.function():
+            self.observe(value)
+        return super().samples()
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def gauge(self, name, help_text, function=None):
+        return self.register(Gauge(name, help_text, function))
+
+    def histogram(self, name, help_text, buckets=DURATION_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def distribution(self, name, help_text, function, buckets):
+        return self.register(DistributionGauge(name, help_text, function, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.processName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# (pid, QueueListener) процесса, настроившего логирование
+_listener = None
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """Логи пишутся в stderr отдельным потоком: цикл событий только кладет
+    запись в очередь и не ждет медленного вывода. Возвращает QueueListener.
+
+    Повторный вызов в том же процессе возвращает уже запущенный; процесс,
+    созданный fork-ом, потока вывода не наследует и запускает свой."""
+    global _listener
+    if _listener is not None and _listener[0] == os.getpid():
+        return _listener[1]
+    if fmt == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s')
+    output = logging.StreamHandler()
+    output.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(records)]
+    root.setLevel(level)
+    # Строка на каждый запрос (в том числе на каждое WebSocket-подключение)
+    # нужна только при отладке; ошибки 4xx/5xx tornado пишет уровнем WARNING
+    if logging.getLevelName(level) != logging.DEBUG:
+        logging.getLogger('tornado.access').setLevel(logging.WARNING)
+    listener.start()
+    _listener = (os.getpid(), listener)
+    # При выходе дописываем оставшиеся в очереди записи
+    atexit.register(stop_logging)
+    return listener
+
+
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи; повторный вызов ничего не делает.
+
+    Дочерние процессы multiprocessing завершаются без atexit, поэтому
+    вызывают ее сами."""
+    global _listener
+    if _listener is not None and _listener[0] == os.getpid():
+        _listener[1].stop()
+        _listener = None
@@ -0,0 +1,149 @@
+"""Локальная замена API ЦБ (daily_json.js) для тестов и бенчмарков без сети.
+
+Запуск:
+    python mock_cbr.py --port 8899 --change-every 60
+    CBR_API_URL=http://localhost:8899/daily_json.js python main.py
+
+POST /bump немедленно меняет курсы (удобно, чтобы вызвать рассылку).
+"""
+import argparse
+import asyncio
+import datetime
+import email.utils
+import json
+import random
+
+import tornado.web
+
+# Код валюты -> (номинал, название, базовый курс за номинал)
+BASE_VALUTE = {
+    'USD': (1, 'Доллар США', 92.50),
+    'EUR': (1, 'Евро', 100.10),
+    'GBP': (1, 'Фунт стерлингов', 117.30),
+    'CNY': (1, 'Китайский юань', 12.70),
+    'JPY': (100, 'Японских иен', 61.40),
+    'CHF': (1, 'Швейцарский франк', 104.20),
+    'KZT': (100, 'Казахстанских тенге', 19.30),
+    'TRY': (10, 'Турецких лир', 28.60),
+}
+
+
+class MockRates:
+    """Текущее состояние курсов mock-сервера"""
+
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
+        self.values = {code: value for code, (_, _, value) in BASE_VALUTE.items()}
+        self.version = 0
+        self.requests = 0
+        self.not_modified = 0
+        self.modified_at = datetime.datetime.now(datetime.timezone.utc)
+        self._render()
+
+    def bump(self, volatility=0.005):
+        """Случайно сдвигаем все курсы, как при новой публикации ЦБ"""
+        for code, value in self.values.items():
+            self.values[code] = round(value * (1 + self.random.uniform(-volatility, volatility)), 4)
+        self.version += 1
+        self.modified_at = datetime.datetime.now(datetime.timezone.utc)
+        self._render()
+
+    def _render(self):
+        valute = {}
+        for code, (nominal, name, _) in BASE_VALUTE.items():
+            valute[code] = {
+                'CharCode': code,
+                'Nominal': nominal,
+                'Name': name,
+                'Value': self.values[code],
+            }
+        self.body = json.dumps({
+            'Date': self.modified_at.isoformat(),
+            'Timestamp': self.modified_at.isoformat(),
+            'Valute': valute,
+        }, ensure_ascii=False).encode('utf-8')
+        self.etag = f'"v{self.version}"'
+        self.last_modified = email.utils.format_datetime(self.modified_at, usegmt=True)
+
+
+class DailyJsonHandler(tornado.web.RequestHandler):
+    def initialize(self, rates):
+        self.rates = rates
+
+    def compute_etag(self):
+        # ETag выставляем сами, по номеру версии данных
+        return None
+
+    def get(self):
+        rates = self.rates
+        rates.requests += 1
+        # If-None-Match, если он есть, важнее If-Modified-Since (RFC 9110)
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            not_modified = if_none_match == rates.etag
+        else:
+            not_modified = self.request.headers.get('If-Modified-Since') == rates.last_modified
+        if not_modified:
+            rates.not_modified += 1
+            self.set_status(304)
+            return
+        self.set_header('Content-Type', 'application/javascript; charset=utf-8')
+        self.set_header('ETag', rates.etag)
+        self.set_header('Last-Modified', rates.last_modified)
+        self.write(rates.body)
+
+
+class BumpHandler(tornado.web.RequestHandler):
+    def initialize(self, rates):
+        self.rates = rates
+
+    def post(self):
+        self.rates.bump()
+        self.write({'version': self.rates.version, 'rates': self.rates.values})
+
+
+class StatsHandler(tornado.web.RequestHandler):
+    def initialize(self, rates):
+        self.rates = rates
+
+    def get(self):
+        self.write({
+            'version': self.rates.version,
+            'requests': self.rates.requests,
+            'not_modified': self.rates.not_modified,
+        })
+
+
+def make_mock_app(rates=None):
+    rates = rates or MockRates()
+    return tornado.web.Application([
+        (r"/daily_json.js", DailyJsonHandler, {'rates': rates}),
+        (r"/bump", BumpHandler, {'rates': rates}),
+        (r"/stats", StatsHandler, {'rates': rates}),
+    ])
+
+
+async def change_periodically(rates, interval):
+    while True:
+        await asyncio.sleep(interval)
+        rates.bump()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Mock CBR daily_json.js server')
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--change-every', type=float, default=0,
+                        help='менять курсы каждые N секунд (0 - только по POST /bump)')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    rates = MockRates(seed=args.seed)
+    make_mock_app(rates).listen(args.port)
+    print(f"🧪 Mock ЦБ запущен на http://localhost:{args.port}/daily_json.js")
+    if args.change_every > 0:
+        asyncio.create_task(change_periodically(rates, args.change_every))
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
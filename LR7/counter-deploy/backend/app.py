@@ -1,12 +1,22 @@
+import atexit
+import json
 import os
+import queue
+import threading
 import time
-from flask import Flask, jsonify
-from redis import Redis, RedisError
+from flask import Flask, Response, jsonify
+from redis import BlockingConnectionPool, ConnectionError, RedisError, ResponseError, TimeoutError
 from dotenv import load_dotenv
 from pathlib import Path
-from flask import send_from_directory, request
+from flask import request
 from flask_cors import CORS
 
+from counters import DeltaBuffer, NamedCounters, StripedCounter
+from fallback import CircuitBreaker, GuardedRedis, LocalFallback
+from static_assets import StaticAssets
+from stats import STEPS, ActivityStats
+from stream import ChannelFanout
+
 BASE_DIR = Path(__file__).resolve().parent
 load_dotenv(BASE_DIR / '.env')
 
@@ -14,72 +24,376 @@ REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
 REDIS_DB = int(os.getenv('REDIS_DB', 0))
 REDIS_PASSWORD = os.getenv('REDIS_PASSWORD') or None
+# Pool size per worker process, and how long a request waits for a free connection
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 10))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 2))
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 2))
+REDIS_CONNECT_TIMEOUT = float(os.getenv('REDIS_CONNECT_TIMEOUT', 0.25))
+# After this many connection errors in a row Redis calls fail at once,
+# and one probe goes through every REDIS_CIRCUIT_RESET seconds
+REDIS_CIRCUIT_FAILURES = int(os.getenv('REDIS_CIRCUIT_FAILURES', 3))
+REDIS_CIRCUIT_RESET = float(os.getenv('REDIS_CIRCUIT_RESET', 5))
+# Idle connections are PINGed before reuse if unused for this many seconds
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30))
+
+# strict: every increment/decrement is a Redis round trip and returns the exact value.
+# buffered: deltas are summed per worker and written with one INCRBY every
+# COUNTER_FLUSH_INTERVAL_MS or COUNTER_FLUSH_OPS operations; responses are estimates.
+COUNTER_MODE = os.getenv('COUNTER_MODE', 'strict')
+COUNTER_FLUSH_INTERVAL_MS = float(os.getenv('COUNTER_FLUSH_INTERVAL_MS', 5))
+COUNTER_FLUSH_OPS = int(os.getenv('COUNTER_FLUSH_OPS', 100))
+# Number of Redis keys the counter is spread over (1 - the single counter:value key)
+COUNTER_STRIPES = int(os.getenv('COUNTER_STRIPES', 1))
+# GET /api/counter answers from a per-worker cache this fresh (0 - always ask Redis)
+COUNTER_READ_CACHE_MS = float(os.getenv('COUNTER_READ_CACHE_MS', 0))
+# Channel with the new counter value after every change ('' - do not publish)
+COUNTER_CHANNEL = os.getenv('COUNTER_CHANNEL', 'counter:updates')
+# Seconds between SSE keep-alive comments on an idle stream
+SSE_KEEPALIVE = float(os.getenv('SSE_KEEPALIVE', 15))
+# Activity history: how long minute and hour buckets are kept, flush period,
+# and the largest number of points one /api/counter/stats call may return
+STATS_MINUTE_RETENTION = int(os.getenv('STATS_MINUTE_RETENTION', 2 * 86400))
+STATS_HOUR_RETENTION = int(os.getenv('STATS_HOUR_RETENTION', 90 * 86400))
+STATS_FLUSH_INTERVAL = float(os.getenv('STATS_FLUSH_INTERVAL', 1))
+STATS_MAX_POINTS = int(os.getenv('STATS_MAX_POINTS', 1440))
+# Named counters: default expiry in seconds (0 - never) and batch size limit
+NAMED_COUNTER_TTL = int(os.getenv('NAMED_COUNTER_TTL', 0))
+NAMED_COUNTER_BATCH_LIMIT = int(os.getenv('NAMED_COUNTER_BATCH_LIMIT', 1000))
+# While Redis is down the counter is served locally ("stale": true) and
+# changes are journaled in COUNTER_JOURNAL_DIR until they can be replayed
+COUNTER_FALLBACK = os.getenv('COUNTER_FALLBACK', '1') == '1'
+COUNTER_JOURNAL_DIR = os.getenv('COUNTER_JOURNAL_DIR', str(BASE_DIR / 'journal'))
+COUNTER_JOURNAL_FSYNC = os.getenv('COUNTER_JOURNAL_FSYNC', '1') == '1'
+COUNTER_RECONCILE_INTERVAL = float(os.getenv('COUNTER_RECONCILE_INTERVAL', 1))
 
-app = Flask(__name__, static_folder=str(BASE_DIR / 'static'), static_url_path='/')
+# Static files are served from the in-memory manifest below, not by Flask
+app = Flask(__name__, static_folder=None)
 CORS(app)
 
-# Connect to redis with retry
-def get_redis_client(retries=5, wait=1):
-    for i in range(retries):
-        try:
-            client = Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, password=REDIS_PASSWORD, decode_responses=True)
-            # test
-            client.ping()
-            return client
-        except RedisError as e:
-            if i == retries - 1:
-                raise
-            time.sleep(wait)
-    raise RedisError("Cannot connect to Redis")
-
-r = get_redis_client()
+_redis = None
+_redis_pid = None
+_redis_lock = threading.Lock()
+
+
+def get_redis():
+    """Redis client of the current process, created on first use.
+
+    Nothing connects at import time, so gunicorn workers boot even while
+    Redis is down, and each forked worker gets its own connection pool
+    and circuit breaker."""
+    global _redis, _redis_pid
+    pid = os.getpid()
+    if _redis is None or _redis_pid != pid:
+        with _redis_lock:
+            if _redis is None or _redis_pid != pid:
+                pool = BlockingConnectionPool(
+                    host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, password=REDIS_PASSWORD,
+                    decode_responses=True,
+                    max_connections=REDIS_MAX_CONNECTIONS,
+                    timeout=REDIS_POOL_TIMEOUT,
+                    socket_timeout=REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+                    socket_keepalive=True,
+                    health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+                )
+                breaker = CircuitBreaker(REDIS_CIRCUIT_FAILURES, REDIS_CIRCUIT_RESET)
+                _redis = GuardedRedis(connection_pool=pool, breaker=breaker)
+                _redis_pid = pid
+    return _redis
+
 
 COUNTER_KEY = 'counter:value'
+counter = StripedCounter(get_redis, COUNTER_KEY, COUNTER_STRIPES, COUNTER_READ_CACHE_MS / 1000,
+                         channel=COUNTER_CHANNEL)
+counter_updates = ChannelFanout(get_redis, COUNTER_CHANNEL)
+
+counter_fallback = None
+if COUNTER_FALLBACK:
+    counter_fallback = LocalFallback(counter, COUNTER_JOURNAL_DIR, COUNTER_RECONCILE_INTERVAL,
+                                     COUNTER_JOURNAL_FSYNC)
+
+counter_buffer = None
+if COUNTER_MODE == 'buffered':
+    # A flush that fails while Redis is down goes to the fallback journal
+    counter_buffer = DeltaBuffer(counter, COUNTER_FLUSH_INTERVAL_MS / 1000, COUNTER_FLUSH_OPS,
+                                 fallback=counter_fallback)
+    # Graceful shutdown (gunicorn worker exit, Ctrl+C) writes what is left
+    atexit.register(counter_buffer.flush)
+
+activity = ActivityStats(get_redis, 'counter:stats',
+                         {'minute': STATS_MINUTE_RETENTION, 'hour': STATS_HOUR_RETENTION},
+                         STATS_FLUSH_INTERVAL)
+atexit.register(activity.flush)
+
+
+def client_id():
+    """Who made the request, for distinct-client counts"""
+    forwarded = request.headers.get('X-Forwarded-For', '')
+    return (request.headers.get('X-Client-Id') or forwarded.split(',')[0].strip()
+            or request.remote_addr or '')
 
-# Ensure key exists
-if r.get(COUNTER_KEY) is None:
-    r.set(COUNTER_KEY, 0)
+
+def redis_unavailable():
+    """503 while Redis is down or the circuit breaker is open"""
+    return (jsonify({"error": "Redis is unavailable, try again later"}), 503,
+            {'Retry-After': str(int(REDIS_CIRCUIT_RESET))})
+
+
+def read_counter():
+    """(value, stale)"""
+    if counter_fallback is not None:
+        value, stale = counter_fallback.get()
+    else:
+        value, stale = counter.get(), False
+    if counter_buffer is not None:
+        value = counter_buffer.read(value)
+    return value, stale
+
+
+def change_counter(delta):
+    """(value, estimated, stale)"""
+    if counter_buffer is not None:
+        # Failed flushes go to the fallback journal: stale like a GET then
+        stale = counter_fallback is not None and counter_fallback.stale
+        return counter_buffer.add(delta), True, stale
+    if counter_fallback is not None:
+        value, stale = counter_fallback.incr(delta)
+        return value, stale, stale
+    return counter.incr(delta), False, False
 
 @app.route('/api/counter', methods=['GET'])
 def get_counter():
     try:
-        v = int(r.get(COUNTER_KEY) or 0)
-        return jsonify({"value": v})
+        v, stale = read_counter()
+        return jsonify({"value": v, "stale": stale})
+    except (ConnectionError, TimeoutError):
+        return redis_unavailable()
     except Exception as e:
         return jsonify({"error": "Redis error"}), 500
 
+@app.route('/api/counter/stream', methods=['GET'])
+def counter_stream():
+    """Server-Sent Events with the counter value after every change.
+
+    Each open stream holds a worker connection: run gunicorn with an async
+    worker class (gevent) so streams do not exhaust the sync workers."""
+    if not COUNTER_CHANNEL:
+        return jsonify({"error": "Counter updates are disabled"}), 404
+    listener = counter_updates.listen()
+
+    def events():
+        try:
+            try:
+                yield f"data: {json.dumps({'value': counter.get()})}\n\n"
+            except RedisError:
+                pass
+            while True:
+                try:
+                    value = listener.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps({'value': int(value)})}\n\n"
+        finally:
+            counter_updates.unlisten(listener)
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Do not let a reverse proxy buffer the stream
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/api/counter/stats', methods=['GET'])
+def counter_stats():
+    """?from=&to= (unix seconds, default - the last 60 steps), step=minute|hour"""
+    step = request.args.get('step', 'minute')
+    try:
+        if step not in STEPS:
+            raise ValueError(f"'step' must be one of: {', '.join(STEPS)}")
+        now = int(time.time())
+        t_to = int_param({}, 'to', now, minimum=0)
+        t_from = int_param({}, 'from', t_to - 59 * STEPS[step][0], minimum=0)
+        if t_from > t_to:
+            raise ValueError("'from' must not be after 'to'")
+        if (t_to - t_from) // STEPS[step][0] + 1 > STATS_MAX_POINTS:
+            raise ValueError(f"at most {STATS_MAX_POINTS} points per request, use a larger step")
+        points = activity.query(step, t_from, t_to)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except (ConnectionError, TimeoutError):
+        return redis_unavailable()
+    except RedisError:
+        return jsonify({"error": "Redis error"}), 500
+    return jsonify({"step": step, "from": t_from, "to": t_to, "points": points})
+
 @app.route('/api/counter/increment', methods=['POST'])
 def increment():
     try:
-        v = r.incr(COUNTER_KEY)
-        return jsonify({"value": int(v)})
+        v, estimated, stale = change_counter(1)
+        activity.record('increment', client_id())
+        return jsonify({"value": v, "estimated": estimated, "stale": stale})
+    except (ConnectionError, TimeoutError):
+        return redis_unavailable()
     except Exception as e:
         return jsonify({"error": "Redis error"}), 500
 
 @app.route('/api/counter/decrement', methods=['POST'])
 def decrement():
     try:
-        v = r.decr(COUNTER_KEY)
-        return jsonify({"value": int(v)})
+        v, estimated, stale = change_counter(-1)
+        activity.record('decrement', client_id())
+        return jsonify({"value": v, "estimated": estimated, "stale": stale})
+    except (ConnectionError, TimeoutError):
+        return redis_unavailable()
     except Exception as e:
         return jsonify({"error": "Redis error"}), 500
 
 @app.route('/api/counter/reset', methods=['POST'])
 def reset():
+    """A reset needs Redis: it cannot be journaled like a delta.
+
+    Deltas that other workers journaled while Redis was down are replayed
+    after the reset and count towards the new value."""
+    if get_redis().breaker.is_open:
+        return redis_unavailable()
     try:
-        r.set(COUNTER_KEY, 0)
-        return jsonify({"value": 0})
+        if counter_buffer is not None:
+            # Clicks buffered before the reset are dropped with it
+            counter_buffer.discard()
+        counter.reset()
+        if counter_fallback is not None:
+            # Changes journaled before the reset are dropped with it
+            counter_fallback.discard()
+        activity.record('reset', client_id())
+        return jsonify({"value": 0, "stale": False})
+    except (ConnectionError, TimeoutError):
+        return redis_unavailable()
     except Exception as e:
         return jsonify({"error": "Redis error"}), 500
 
+named_counters = NamedCounters(get_redis, default_ttl=NAMED_COUNTER_TTL)
+
+
+# Redis integers (values, increments, TTLs) are signed 64-bit
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+# Redis errors caused by the arguments rather than by Redis itself
+OUT_OF_RANGE_ERRORS = ('would overflow', 'out of range', 'invalid expire time')
+
+
+def int_param(data, field, default=None, minimum=INT64_MIN):
+    """Integer from the JSON body or the query string, at most INT64_MAX"""
+    value = data.get(field, request.args.get(field, default))
+    if isinstance(value, str):
+        value = int(value) if value.lstrip('-').isdigit() else None
+    if not isinstance(value, int) or isinstance(value, bool) or not minimum <= value <= INT64_MAX:
+        raise ValueError(f"'{field}' must be an integer from {minimum} to {INT64_MAX}")
+    return value
+
+
+def json_body():
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
+
+def named_counter_call(operation):
+    try:
+        return operation()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except (ConnectionError, TimeoutError):
+        return redis_unavailable()
+    except ResponseError as e:
+        # E.g. an INCRBY past the 64-bit range or a TTL Redis cannot store
+        if any(message in str(e) for message in OUT_OF_RANGE_ERRORS):
+            return jsonify({"error": "value out of the 64-bit integer range"}), 400
+        return jsonify({"error": "Redis error"}), 500
+    except RedisError:
+        return jsonify({"error": "Redis error"}), 500
+
+@app.route('/api/counters', methods=['GET'])
+def list_counters():
+    def operation():
+        cursor, values = named_counters.scan(
+            match=request.args.get('match', '*'),
+            cursor=int_param({}, 'cursor', 0, minimum=0),
+            count=min(int_param({}, 'count', 100, minimum=1), NAMED_COUNTER_BATCH_LIMIT))
+        return jsonify({"counters": values, "cursor": cursor})
+    return named_counter_call(operation)
+
+@app.route('/api/counters/<name>', methods=['GET'])
+def get_named_counter(name):
+    return named_counter_call(lambda: jsonify({"name": name, "value": named_counters.get(name)}))
+
+@app.route('/api/counters/<name>/increment', methods=['POST'])
+def increment_named_counter(name):
+    def operation():
+        data = json_body()
+        ttl = int_param(data, 'ttl', NAMED_COUNTER_TTL, minimum=0)
+        value = named_counters.incr(name, int_param(data, 'by', 1), ttl)
+        activity.record('named_increment', client_id())
+        return jsonify({"name": name, "value": value})
+    return named_counter_call(operation)
+
+@app.route('/api/counters/<name>/decrement', methods=['POST'])
+def decrement_named_counter(name):
+    def operation():
+        data = json_body()
+        ttl = int_param(data, 'ttl', NAMED_COUNTER_TTL, minimum=0)
+        value = named_counters.incr(name, -int_param(data, 'by', 1), ttl)
+        activity.record('named_decrement', client_id())
+        return jsonify({"name": name, "value": value})
+    return named_counter_call(operation)
+
+@app.route('/api/counters/<name>/reset', methods=['POST'])
+def reset_named_counter(name):
+    def operation():
+        ttl = int_param(json_body(), 'ttl', NAMED_COUNTER_TTL, minimum=0)
+        value = named_counters.reset(name, ttl)
+        activity.record('named_reset', client_id())
+        return jsonify({"name": name, "value": value})
+    return named_counter_call(operation)
+
+@app.route('/api/counters:batchGet', methods=['POST'])
+def batch_get_counters():
+    """{"names": ["a", "b"]} -> {"values": {"a": 1, "b": 0}}"""
+    def operation():
+        names = json_body().get('names')
+        if not isinstance(names, list) or len(names) > NAMED_COUNTER_BATCH_LIMIT:
+            raise ValueError(f"'names' must be a list of at most {NAMED_COUNTER_BATCH_LIMIT} names")
+        return jsonify({"values": named_counters.get_many(names)})
+    return named_counter_call(operation)
+
+@app.route('/api/counters:batchIncr', methods=['POST'])
+def batch_increment_counters():
+    """{"increments": {"a": 1, "b": -2}, "ttl": 3600} -> {"values": {"a": 1, "b": -2}}"""
+    def operation():
+        data = json_body()
+        increments = data.get('increments')
+        if not isinstance(increments, dict) or len(increments) > NAMED_COUNTER_BATCH_LIMIT:
+            raise ValueError(f"'increments' must map at most {NAMED_COUNTER_BATCH_LIMIT} names to integers")
+        deltas = {name: int_param(increments, name) for name in increments}
+        ttl = int_param(data, 'ttl', NAMED_COUNTER_TTL, minimum=0)
+        values = named_counters.incr_many(deltas, ttl)
+        # One operation per counter in the batch
+        for operation, count in (('named_increment', sum(1 for d in deltas.values() if d > 0)),
+                                 ('named_decrement', sum(1 for d in deltas.values() if d < 0))):
+            if count:
+                activity.record(operation, client_id(), count=count)
+        return jsonify({"values": values})
+    return named_counter_call(operation)
+
 # Serve SPA
+static_assets = StaticAssets(BASE_DIR / 'static')
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve_spa(path):
-    static_dir = BASE_DIR / 'static'
-    if path != "" and (static_dir / path).exists():
-        return send_from_directory(str(static_dir), path)
-    return send_from_directory(str(static_dir), 'index.html')
+    asset = static_assets.get(path) or static_assets.get('index.html')
+    if asset is None:
+        return jsonify({"error": "Frontend is not built"}), 404
+    status, headers, body = static_assets.response(asset, request.headers)
+    return Response(static_assets.chunks(body), status=status, headers=headers, direct_passthrough=True)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.getenv('PORT', 8000)))
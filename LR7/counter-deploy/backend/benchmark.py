@@ -0,0 +1,302 @@
+"""Load test of the counter backend under different gunicorn worker classes.
+
+Starts Redis (an existing URL, a local redis-server, or fakeredis over TCP for
+pure-CPU runs), then for every worker class x worker count x GET/POST mix
+starts gunicorn, drives it with closed-loop keep-alive HTTP clients spread
+over several processes and prints JSON:
+
+    python benchmark.py --redis fake --worker-classes sync,gthread,gevent --workers 1,2,4
+    python benchmark.py --redis local --mixes 90:10,50:50 --duration 20 --output result.json
+
+Round trips per request are counted separately, by running each endpoint
+through the Flask test client with redis-py's socket writes instrumented.
+--redis fake needs the fakeredis package (with lupa for the Lua scripts);
+gunicorn has no asyncio worker for WSGI apps, so eventlet stands for the
+second event-loop class next to gevent and is skipped when not installed.
+"""
+import argparse
+import http.client
+import importlib.util
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+WORKER_CLASSES = {
+    # class -> (gunicorn arguments, module the class needs)
+    'sync': ([], None),
+    'gthread': (['--threads', '8'], None),
+    'gevent': (['--worker-connections', '1000'], 'gevent'),
+    'eventlet': (['--worker-connections', '1000'], 'eventlet'),
+}
+
+ENDPOINTS = {
+    'get': ('GET', '/api/counter'),
+    'increment': ('POST', '/api/counter/increment'),
+    'decrement': ('POST', '/api/counter/decrement'),
+    'reset': ('POST', '/api/counter/reset'),
+    'stats': ('GET', '/api/counter/stats'),
+    'named_increment': ('POST', '/api/counters/bench/increment'),
+    'batch_get': ('POST', '/api/counters:batchGet'),
+}
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_http(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                return response.status
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def wait_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def start_redis(kind):
+    """(host, port, process or None) for --redis fake|local|redis://host:port"""
+    if kind.startswith('redis://'):
+        host, _, port = kind[len('redis://'):].split('/')[0].partition(':')
+        return host, int(port or 6379), None
+    port = free_port()
+    if kind == 'local':
+        if shutil.which('redis-server') is None:
+            raise SystemExit('redis-server not found; use --redis fake or --redis redis://host:port')
+        command = ['redis-server', '--port', str(port), '--save', '', '--appendonly', 'no']
+    elif kind == 'fake':
+        command = [sys.executable, '-c',
+                   'import sys; from fakeredis import TcpFakeServer; '
+                   'TcpFakeServer(("127.0.0.1", int(sys.argv[1])), server_type="redis").serve_forever()',
+                   str(port)]
+    else:
+        raise SystemExit(f'unknown --redis value: {kind}')
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_port(port)
+    return '127.0.0.1', port, process
+
+
+def count_round_trips(env, endpoints, repeat, results):
+    """Runs in a fresh process: the app reads its settings at import time"""
+    os.environ.update(env)
+    sys.path.insert(0, HERE)
+    import redis.connection
+
+    sent = [0]
+    original = redis.connection.AbstractConnection.send_packed_command
+
+    def send_packed_command(self, command, check_health=True):
+        # One call per request-response exchange: pipelines and scripts
+        # are packed into a single write
+        sent[0] += 1
+        return original(self, command, check_health)
+
+    redis.connection.AbstractConnection.send_packed_command = send_packed_command
+    import app
+
+    client = app.app.test_client()
+    body = {'names': [f'bench{i}' for i in range(50)]}
+    counts = {}
+    for name in endpoints:
+        method, path = ENDPOINTS[name]
+        # The first call warms up the connection and loads Lua scripts
+        client.open(path, method=method, json=body)
+        sent[0] = 0
+        for _ in range(repeat):
+            client.open(path, method=method, json=body)
+        counts[name] = sent[0] / repeat
+    results.put(counts)
+
+
+def measure_round_trips(env, endpoints, repeat=20):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=count_round_trips, args=(env, endpoints, repeat, results))
+    process.start()
+    counts = results.get(timeout=60)
+    process.join()
+    return counts
+
+
+def client_thread(host, port, deadline, get_ratio, seed, latencies, errors):
+    """Closed-loop client on one keep-alive connection: the next request
+    goes out after the previous answer"""
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    while time.monotonic() < deadline:
+        method, path = ENDPOINTS['get' if rng.random() < get_ratio else 'increment']
+        started = time.perf_counter()
+        try:
+            connection.request(method, path)
+            response = connection.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors.append(1)
+    connection.close()
+
+
+def load_process(port, concurrency, duration, get_ratio, seed, results):
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=client_thread,
+                                args=('127.0.0.1', port, deadline, get_ratio, seed * 1000 + i, latencies, errors))
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((latencies, len(errors)))
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+
+
+def run_case(args, env, worker_class, workers, get_ratio):
+    port = free_port()
+    extra, _ = WORKER_CLASSES[worker_class]
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--worker-class', worker_class, *extra,
+               '--log-level', 'warning', 'app:app']
+    server = subprocess.Popen(command, cwd=HERE, env=dict(os.environ, **env),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    try:
+        wait_http(url + '/api/counter')
+        results = multiprocessing.Queue()
+        share = max(args.concurrency // args.processes, 1)
+        loaders = [multiprocessing.Process(target=load_process,
+                                           args=(port, share, args.duration, get_ratio, i, results))
+                   for i in range(args.processes)]
+        started = time.monotonic()
+        for loader in loaders:
+            loader.start()
+        latencies, errors = [], 0
+        for _ in loaders:
+            part, part_errors = results.get()
+            latencies.extend(part)
+            errors += part_errors
+        for loader in loaders:
+            loader.join()
+        elapsed = time.monotonic() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    return {
+        'worker_class': worker_class,
+        'workers': workers,
+        'get_ratio': get_ratio,
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50),
+            'p90': percentile(latencies, 0.90),
+            'p99': percentile(latencies, 0.99),
+            'max': round(latencies[-1] * 1000, 3) if latencies else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Counter backend load test')
+    parser.add_argument('--redis', default='fake', help='fake, local or redis://host:port')
+    parser.add_argument('--worker-classes', default='sync,gthread,gevent')
+    parser.add_argument('--workers', default='1,2,4', help='worker counts, comma separated')
+    parser.add_argument('--mixes', default='90:10,50:50', help='GET:POST percentages, comma separated')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per case')
+    parser.add_argument('--concurrency', type=int, default=64, help='concurrent HTTP clients in total')
+    parser.add_argument('--processes', type=int, default=2, help='load generator processes')
+    parser.add_argument('--counter-mode', choices=['strict', 'buffered'], default='strict')
+    parser.add_argument('--stripes', type=int, default=1)
+    parser.add_argument('--output', help='file for the JSON result (default: stdout)')
+    args = parser.parse_args()
+
+    host, port, redis_process = start_redis(args.redis)
+    env = {
+        'REDIS_HOST': host,
+        'REDIS_PORT': str(port),
+        'COUNTER_MODE': args.counter_mode,
+        'COUNTER_STRIPES': str(args.stripes),
+        'REDIS_MAX_CONNECTIONS': '64',
+    }
+    result = {'config': vars(args), 'round_trips_per_request': None, 'cases': [], 'skipped': []}
+    try:
+        # Background flushes would be counted as request round trips
+        result['round_trips_per_request'] = measure_round_trips(
+            dict(env, STATS_FLUSH_INTERVAL='3600', COUNTER_FLUSH_INTERVAL_MS='3600000',
+                 COUNTER_FLUSH_OPS='1000000000'),
+            list(ENDPOINTS))
+        log(f"🔁 Round trips per request: {result['round_trips_per_request']}")
+
+        for worker_class in args.worker_classes.split(','):
+            module = WORKER_CLASSES[worker_class][1]
+            if module is not None and importlib.util.find_spec(module) is None:
+                result['skipped'].append({'worker_class': worker_class, 'reason': f'{module} is not installed'})
+                log(f"⏭  {worker_class}: {module} is not installed")
+                continue
+            for workers in (int(w) for w in args.workers.split(',')):
+                for mix in args.mixes.split(','):
+                    get_ratio = int(mix.split(':')[0]) / 100
+                    case = run_case(args, env, worker_class, workers, get_ratio)
+                    trips = result['round_trips_per_request']
+                    case['redis_round_trips_per_request'] = round(
+                        get_ratio * trips['get'] + (1 - get_ratio) * trips['increment'], 3)
+                    result['cases'].append(case)
+                    log(f"📊 {worker_class:8} x{workers} GET {mix:6} "
+                        f"{case['rps']:9.1f} rps  p99 {case['latency_ms']['p99']} ms  errors {case['errors']}")
+    finally:
+        if redis_process is not None:
+            redis_process.terminate()
+            redis_process.wait()
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+import os
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from redis import RedisError, TimeoutError
+
+# Resets every stripe in one atomic step (all stripes share a hash slot).
+# ARGV[1] - channel for the new value ('' - do not publish)
+RESET_SCRIPT = """
+redis.call('SET', KEYS[1], 0)
+if #KEYS > 1 then
+    redis.call('DEL', unpack(KEYS, 2))
+end
+if ARGV[1] ~= '' then
+    redis.call('PUBLISH', ARGV[1], 0)
+end
+return 0
+"""
+
+# INCRBY on stripe ARGV[2] (1-based), sum of all stripes, PUBLISH of the sum
+# on channel ARGV[3] - one round trip for a change that subscribers see
+INCR_PUBLISH_SCRIPT = """
+redis.call('INCRBY', KEYS[tonumber(ARGV[2])], ARGV[1])
+local total = 0
+for _, value in ipairs(redis.call('MGET', unpack(KEYS))) do
+    if value then
+        total = total + tonumber(value)
+    end
+end
+redis.call('PUBLISH', ARGV[3], total)
+return total
+"""
+
+# INCR_PUBLISH_SCRIPT applied at most once per batch: KEYS[1] is the batch
+# marker, set with NX; a batch sent again finds it and only reads the total.
+# ARGV[1] - delta, ARGV[2] - stripe among KEYS[2..] (1-based),
+# ARGV[3] - channel ('' - do not publish), ARGV[4] - marker TTL in seconds
+INCR_ONCE_SCRIPT = """
+local marker = table.remove(KEYS, 1)
+if redis.call('SET', marker, 1, 'NX', 'EX', ARGV[4]) then
+    redis.call('INCRBY', KEYS[tonumber(ARGV[2])], ARGV[1])
+end
+local total = 0
+for _, value in ipairs(redis.call('MGET', unpack(KEYS))) do
+    if value then
+        total = total + tonumber(value)
+    end
+end
+if ARGV[3] ~= '' then
+    redis.call('PUBLISH', ARGV[3], total)
+end
+return total
+"""
+
+# INCRBY for every key with its own delta, optionally refreshing the TTL.
+# ARGV[1] - TTL in seconds (0 - keep), ARGV[2..] - deltas in KEYS order
+INCR_MANY_SCRIPT = """
+local ttl = tonumber(ARGV[1])
+local result = {}
+for i, key in ipairs(KEYS) do
+    result[i] = redis.call('INCRBY', key, ARGV[i + 1])
+    if ttl > 0 then
+        redis.call('EXPIRE', key, ttl)
+    end
+end
+return result
+"""
+
+COUNTER_NAME = re.compile(r'^[A-Za-z0-9_.-]{1,100}$')
+
+
+def stripe_keys(key, stripes):
+    """Stripe 0 is the plain key, so a single-key counter keeps its value.
+
+    The other stripes carry the whole key as a hash tag ({key}:i), which maps
+    them to the same Redis Cluster slot as the plain key: MGET and the reset
+    script stay single-slot operations."""
+    return [key] + [f'{{{key}}}:{i}' for i in range(1, stripes)]
+
+
+class StripedCounter:
+    """Counter spread over several Redis keys to avoid a single hot key.
+
+    Each worker thread writes to its own stripe; the value is the sum of all
+    stripes, read with one MGET. Every operation is one round trip.
+    With a channel every change also publishes the new total there."""
+
+    def __init__(self, redis_getter, key, stripes=1, read_cache_ttl=0, channel=None):
+        self.redis = redis_getter
+        self.key = key
+        self.keys = stripe_keys(key, max(stripes, 1))
+        self.read_cache_ttl = read_cache_ttl
+        self.channel = channel
+        self._cached = None
+        self._reset = None
+        self._incr_publish = None
+        self._incr_once = None
+
+    def _stripe_index(self):
+        if len(self.keys) == 1:
+            return 0
+        return hash((os.getpid(), threading.get_ident())) % len(self.keys)
+
+    def _remember(self, value):
+        if self.read_cache_ttl:
+            self._cached = (value, time.monotonic() + self.read_cache_ttl)
+        return value
+
+    def incr(self, delta):
+        """Add delta and return the new total"""
+        if self.channel:
+            if self._incr_publish is None:
+                self._incr_publish = self.redis().register_script(INCR_PUBLISH_SCRIPT)
+            total = self._incr_publish(keys=self.keys, args=[delta, self._stripe_index() + 1, self.channel],
+                                       client=self.redis())
+            return self._remember(int(total))
+        if len(self.keys) == 1:
+            return self._remember(int(self.redis().incrby(self.key, delta)))
+        pipe = self.redis().pipeline(transaction=False)
+        pipe.incrby(self.keys[self._stripe_index()], delta)
+        pipe.mget(self.keys)
+        _, values = pipe.execute()
+        return self._remember(sum(int(v) for v in values if v is not None))
+
+    def incr_once(self, batch_id, delta, ttl):
+        """Add delta unless batch batch_id was already applied; return the total.
+
+        The marker shares the hash tag of the stripes, so the script stays a
+        single-slot operation. It is kept for ttl seconds: a batch sent again
+        later than that would be counted twice."""
+        if self._incr_once is None:
+            self._incr_once = self.redis().register_script(INCR_ONCE_SCRIPT)
+        marker = f'{{{self.key}}}:batch:{batch_id}'
+        total = self._incr_once(keys=[marker] + self.keys,
+                                args=[delta, self._stripe_index() + 1, self.channel or '', ttl],
+                                client=self.redis())
+        return self._remember(int(total))
+
+    def get(self):
+        """Current total; repeated reads within read_cache_ttl are served locally"""
+        cached = self._cached
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        if len(self.keys) == 1:
+            return self._remember(int(self.redis().get(self.key) or 0))
+        values = self.redis().mget(self.keys)
+        return self._remember(sum(int(v) for v in values if v is not None))
+
+    def reset(self):
+        if len(self.keys) == 1 and not self.channel:
+            self.redis().set(self.key, 0)
+        else:
+            if self._reset is None:
+                self._reset = self.redis().register_script(RESET_SCRIPT)
+            self._reset(keys=self.keys, args=[self.channel or ''], client=self.redis())
+        return self._remember(0)
+
+
+class WriteBehind(ABC):
+    """Per-process buffer written to Redis by a background thread.
+
+    Subclasses collect data under self.lock and implement flush(); the
+    thread calls it every interval seconds or as soon as wakeup is set."""
+    thread_name = 'write-behind'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def _ensure_flusher(self):
+        # Threads do not survive fork: start one in every worker
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+                    self.thread.start()
+                    self.pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except RedisError:
+                # Buffered data is kept and retried on the next tick
+                pass
+
+    @abstractmethod
+    def flush(self):
+        """Write the collected data; RedisError keeps it for the next tick"""
+
+
+class DeltaBuffer(WriteBehind):
+    """Write-behind buffer of counter deltas for one worker process.
+
+    With a fallback (LocalFallback) a delta that cannot be written is
+    handed to its journal instead of staying in memory, so it survives
+    the worker's exit while Redis is down."""
+    thread_name = 'counter-flusher'
+
+    def __init__(self, counter, interval, max_ops, fallback=None):
+        super().__init__(interval)
+        self.counter = counter
+        self.max_ops = max_ops
+        self.fallback = fallback
+        self.pending = 0
+        self.ops = 0
+        # Last total seen in Redis; estimates are this plus the pending delta
+        self.last_value = 0
+
+    def add(self, delta):
+        """Buffer a delta and return the estimated counter value"""
+        self._ensure_flusher()
+        with self.lock:
+            self.pending += delta
+            self.ops += 1
+            if self.ops >= self.max_ops:
+                self.wakeup.set()
+            return self.last_value + self.pending
+
+    def flush(self):
+        """Write the pending delta in one round trip"""
+        with self.flush_lock:
+            with self.lock:
+                delta, self.pending, self.ops = self.pending, 0, 0
+            if not delta:
+                return
+            try:
+                value = self.counter.incr(delta)
+            except TimeoutError:
+                # Redis may have applied the INCRBY before the reply timed out:
+                # sending or journaling it again could count it twice
+                raise
+            except RedisError:
+                if self.fallback is not None:
+                    # Estimates go on from the total the fallback now expects
+                    value, _ = self.fallback.defer(delta)
+                    with self.lock:
+                        self.last_value = value
+                    return
+                with self.lock:
+                    self.pending += delta
+                raise
+            with self.lock:
+                self.last_value = value
+
+    def read(self, value):
+        """Counter total in Redis adjusted by this worker's unflushed delta"""
+        with self.lock:
+            self.last_value = value
+            return value + self.pending
+
+    def discard(self):
+        # Waits for an in-flight flush so it cannot land after a reset
+        with self.flush_lock, self.lock:
+            self.pending, self.ops, self.last_value = 0, 0, 0
+
+
+class NamedCounters:
+    """Independent counters addressed by name, one Redis key each.
+
+    Bulk reads are a single MGET and bulk increments a single Lua call, so
+    any number of counters costs one round trip."""
+
+    def __init__(self, redis_getter, prefix='counters:', default_ttl=0):
+        self.redis = redis_getter
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        self._incr_many = None
+
+    def key(self, name):
+        if not isinstance(name, str) or not COUNTER_NAME.match(name):
+            raise ValueError(f"invalid counter name: {name!r}")
+        return self.prefix + name
+
+    def get_many(self, names):
+        keys = [self.key(name) for name in names]
+        if not keys:
+            return {}
+        values = self.redis().mget(keys)
+        return {name: int(v or 0) for name, v in zip(names, values)}
+
+    def get(self, name):
+        return self.get_many([name])[name]
+
+    def incr_many(self, deltas, ttl=None):
+        """deltas: {name: delta}; returns {name: new value}"""
+        names = list(deltas)
+        keys = [self.key(name) for name in names]
+        if not keys:
+            return {}
+        if self._incr_many is None:
+            self._incr_many = self.redis().register_script(INCR_MANY_SCRIPT)
+        ttl = self.default_ttl if ttl is None else ttl
+        values = self._incr_many(keys=keys, args=[int(ttl)] + [deltas[name] for name in names],
+                                 client=self.redis())
+        return {name: int(v) for name, v in zip(names, values)}
+
+    def incr(self, name, delta, ttl=None):
+        return self.incr_many({name: delta}, ttl)[name]
+
+    def reset(self, name, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        self.redis().set(self.key(name), 0, ex=int(ttl) or None)
+        return 0
+
+    def scan(self, match='*', cursor=0, count=100):
+        """One SCAN step over counter keys: (next cursor, {name: value}).
+
+        A next cursor of 0 means the listing is complete."""
+        cursor, keys = self.redis().scan(cursor=cursor, match=self.prefix + match, count=count)
+        if not keys:
+            return cursor, {}
+        values = self.redis().mget(keys)
+        return cursor, {key[len(self.prefix):]: int(v or 0)
+                        for key, v in zip(keys, values) if v is not None}
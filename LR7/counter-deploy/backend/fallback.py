@@ -0,0 +1,295 @@
+import fcntl
+import os
+import threading
+import time
+import uuid
+
+from redis import ConnectionError, Redis, RedisError, TimeoutError
+from redis.client import Pipeline
+
+from counters import WriteBehind
+
+
+class CircuitOpenError(ConnectionError):
+    """Redis is known to be down: the command was not sent"""
+
+
+class CircuitBreaker:
+    """Stops calling Redis after failure_threshold connection errors in a row.
+
+    While open, calls fail at once with CircuitOpenError; after reset_timeout
+    seconds one call is let through as a probe and closes the circuit again
+    if it succeeds. Only connection errors and timeouts count: a command
+    error (wrong type, missing script) means Redis is up."""
+
+    def __init__(self, failure_threshold=3, reset_timeout=5.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def _allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.probing and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.probing = True
+                return True
+            return False
+
+    def _record(self, ok):
+        with self.lock:
+            self.probing = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.opened_at is not None or self.failures >= self.failure_threshold:
+                    self.opened_at = time.monotonic()
+
+    def call(self, function, *args, **kwargs):
+        if not self._allow():
+            raise CircuitOpenError('Redis circuit is open')
+        try:
+            result = function(*args, **kwargs)
+        except (ConnectionError, TimeoutError):
+            self._record(False)
+            raise
+        except BaseException:
+            # Redis answered, only not the way the caller wanted
+            self._record(True)
+            raise
+        self._record(True)
+        return result
+
+
+class GuardedPipeline(Pipeline):
+    def __init__(self, breaker, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.breaker = breaker
+
+    def execute(self, raise_on_error=True):
+        return self.breaker.call(super().execute, raise_on_error)
+
+
+class GuardedRedis(Redis):
+    """Redis client whose commands, scripts and pipelines go through a breaker"""
+
+    def __init__(self, *args, breaker, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.breaker = breaker
+
+    def execute_command(self, *args, **options):
+        return self.breaker.call(super().execute_command, *args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return GuardedPipeline(self.breaker, self.connection_pool, self.response_callbacks,
+                               transaction, shard_hint)
+
+
+def read_journal(lines):
+    """(loose delta, {batch id: delta}) from the lines of a journal.
+
+    A line is a delta ("5"), the loose deltas so far sealed into a batch
+    before it is sent ("seal <id> 5"), or a batch Redis applied
+    ("done <id>"). A torn last line after a crash is skipped."""
+    loose, batches = 0, {}
+    for line in lines:
+        parts = line.split()
+        try:
+            if not parts:
+                continue
+            if parts[0] == 'seal':
+                delta = int(parts[2])
+                batches[parts[1]] = delta
+                loose -= delta
+            elif parts[0] == 'done':
+                batches.pop(parts[1], None)
+            else:
+                loose += int(parts[0])
+        except (IndexError, ValueError):
+            continue
+    return loose, batches
+
+
+class LocalFallback(WriteBehind):
+    """Keeps the counter working while Redis is unreachable.
+
+    Reads fall back to the last value this worker saw; changes are applied
+    to it locally and appended to a journal file of the worker
+    (<journal_dir>/<pid>.journal), so they survive a restart. A background
+    thread replays the journal once Redis answers again. Journals of
+    workers that are gone are replayed by whichever worker manages to lock
+    them first.
+
+    Replay is idempotent: pending deltas are sealed into a batch with an
+    id, written to the journal before the batch is sent, and applied with
+    StripedCounter.incr_once(). A batch sent again after a timeout or a
+    crash is not counted twice while its marker lives (batch_ttl)."""
+    thread_name = 'counter-reconciler'
+
+    def __init__(self, counter, journal_dir, interval=1.0, fsync=True, batch_ttl=7 * 86400):
+        super().__init__(interval)
+        self.counter = counter
+        self.journal_dir = str(journal_dir)
+        self.fsync = fsync
+        self.batch_ttl = batch_ttl
+        self.last_value = 0
+        # Everything not yet confirmed by Redis, sealed batches included
+        self.pending = 0
+        # Sealed batches: id -> delta
+        self.batches = {}
+        self.journal = None
+        self.journal_pid = None
+
+    def _journal(self):
+        """This worker's journal, opened and locked on first use in a process.
+
+        Deltas and batches left in it by a previous process with the same
+        pid become pending again, so a restarted worker replays them."""
+        if self.journal_pid != os.getpid():
+            os.makedirs(self.journal_dir, exist_ok=True)
+            path = os.path.join(self.journal_dir, f'{os.getpid()}.journal')
+            while True:
+                journal = open(path, 'a+')
+                fcntl.flock(journal, fcntl.LOCK_EX)
+                # Another worker may have replayed and removed it meanwhile
+                if os.fstat(journal.fileno()).st_nlink:
+                    break
+                journal.close()
+            journal.seek(0)
+            loose, self.batches = read_journal(journal.readlines())
+            self.pending = loose + sum(self.batches.values())
+            self.journal = journal
+            self.journal_pid = os.getpid()
+        return self.journal
+
+    def _write_journal(self, lines, journal=None):
+        journal = journal or self._journal()
+        journal.write(lines)
+        journal.flush()
+        if self.fsync:
+            os.fsync(journal.fileno())
+
+    @property
+    def stale(self):
+        """Local changes are waiting to be replayed to Redis"""
+        return self.pending != 0
+
+    def remember(self, value):
+        with self.lock:
+            self.last_value = value
+            return value + self.pending
+
+    def get(self):
+        """(value, stale): the Redis total, or the local estimate if Redis is down"""
+        self._ensure_flusher()
+        with self.lock:
+            self._journal()
+        try:
+            value = self.counter.get()
+        except RedisError:
+            with self.lock:
+                return self.last_value + self.pending, True
+        with self.lock:
+            self.last_value = value
+            return value + self.pending, self.pending != 0
+
+    def incr(self, delta):
+        """(value, stale) after adding delta in Redis or, failing that, locally"""
+        self._ensure_flusher()
+        with self.lock:
+            self._journal()
+            pending = self.pending
+        if not pending:
+            try:
+                return self.remember(self.counter.incr(delta)), False
+            except TimeoutError:
+                # Redis may have applied the INCRBY before the reply timed
+                # out: a journaled copy could be counted twice
+                raise
+            except RedisError:
+                pass
+        # Journal first so the delta is not applied ahead of older ones
+        return self.defer(delta)
+
+    def defer(self, delta):
+        """(value, stale) after journaling delta for a later replay"""
+        self._ensure_flusher()
+        with self.lock:
+            self._write_journal(f'{delta}\n')
+            self.pending += delta
+            self.wakeup.set()
+            return self.last_value + self.pending, True
+
+    def discard(self):
+        """Drops this worker's pending deltas, e.g. after a reset.
+
+        Only this worker's journal is emptied: deltas other workers
+        journaled before the reset are still replayed on top of it."""
+        with self.flush_lock, self.lock:
+            self._journal().truncate(0)
+            self.pending = 0
+            self.batches = {}
+
+    def _seal(self, loose, batches, journal=None):
+        """Seals loose deltas into a new batch, journaled before it is sent"""
+        if loose:
+            batch_id = uuid.uuid4().hex
+            self._write_journal(f'seal {batch_id} {loose}\n', journal)
+            batches[batch_id] = loose
+
+    def _replay_orphans(self):
+        own = f'{os.getpid()}.journal'
+        try:
+            names = os.listdir(self.journal_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name == own or not name.endswith('.journal'):
+                continue
+            path = os.path.join(self.journal_dir, name)
+            try:
+                f = open(path, 'r+')
+            except FileNotFoundError:
+                continue
+            with f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # The worker that owns it is alive and replays it itself
+                    continue
+                loose, batches = read_journal(f.readlines())
+                self._seal(loose, batches, f)
+                for batch_id, delta in batches.items():
+                    self.counter.incr_once(batch_id, delta, self.batch_ttl)
+                # Emptied first: a worker that opened the file before the
+                # unlink must not replay it a second time
+                f.truncate(0)
+                os.unlink(path)
+
+    def flush(self):
+        """Replays the journals; fails fast while the circuit is open"""
+        with self.flush_lock:
+            with self.lock:
+                self._journal()
+                self._seal(self.pending - sum(self.batches.values()), self.batches)
+                batches = list(self.batches.items())
+            for batch_id, delta in batches:
+                value = self.counter.incr_once(batch_id, delta, self.batch_ttl)
+                with self.lock:
+                    self._write_journal(f'done {batch_id}\n')
+                    del self.batches[batch_id]
+                    self.pending -= delta
+                    self.last_value = value
+                    if not self.pending:
+                        # Nothing left to replay: the journal starts over
+                        self._journal().truncate(0)
+            self._replay_orphans()
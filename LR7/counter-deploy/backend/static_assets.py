@@ -0,0 +1,129 @@
+import gzip
+import hashlib
+import mimetypes
+import mmap
+import os
+import re
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip variants are built
+    brotli = None
+
+# Vite puts content-hashed bundles into assets/: name-<hash>.ext
+HASHED_ASSET = re.compile(r'^assets/.+-[A-Za-z0-9_-]{8,}\.[A-Za-z0-9]+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Everything else (index.html first of all) is revalidated with the ETag
+REVALIDATE = 'no-cache'
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml',
+                      'application/xml', 'application/manifest+json')
+# Smaller files do not get shorter enough to be worth a Content-Encoding
+MIN_COMPRESS_SIZE = 512
+
+
+class Asset:
+    __slots__ = ('body', 'etag', 'content_type', 'cache_control', 'variants')
+
+    def __init__(self, body, etag, content_type, cache_control, variants):
+        self.body = body
+        self.etag = etag
+        self.content_type = content_type
+        self.cache_control = cache_control
+        # Content-Encoding -> compressed body, only if smaller than the original
+        self.variants = variants
+
+
+def accepted_encodings(header):
+    """Encodings from Accept-Encoding that the client did not refuse with q=0"""
+    accepted = set()
+    for item in (header or '').split(','):
+        name, _, params = item.strip().partition(';')
+        params = params.replace(' ', '')
+        if name and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(name.lower())
+    return accepted
+
+
+class StaticAssets:
+    """Manifest of the built SPA, loaded once at startup.
+
+    Small files are kept in memory and large ones are memory-mapped; gzip
+    and brotli variants and strong ETags are computed up front, so a request
+    is a dictionary lookup with no filesystem access."""
+
+    def __init__(self, root, mmap_threshold=1024 * 1024):
+        self.root = str(root)
+        self.mmap_threshold = mmap_threshold
+        self.assets = {}
+        self._files = []
+        if os.path.isdir(self.root):
+            self._scan()
+
+    def _scan(self):
+        for directory, _, files in os.walk(self.root):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                self.assets[name] = self._load(name, path)
+
+    def _load(self, name, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size >= self.mmap_threshold:
+                body = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                # The mapping must outlive this function
+                self._files.append(body)
+            else:
+                body = f.read()
+
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+
+        variants = {}
+        if size >= MIN_COMPRESS_SIZE and content_type.startswith(COMPRESSIBLE_TYPES):
+            data = bytes(body)
+            compressed = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed['br'] = brotli.compress(data, quality=11)
+            variants = {encoding: value for encoding, value in compressed.items() if len(value) < size}
+
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        cache_control = IMMUTABLE if HASHED_ASSET.match(name) else REVALIDATE
+        return Asset(body, etag, content_type, cache_control, variants)
+
+    def get(self, path):
+        return self.assets.get(path)
+
+    @staticmethod
+    def chunks(body, size=256 * 1024):
+        """WSGI body: bytes as is, a memory-mapped file in slices"""
+        if isinstance(body, bytes):
+            return [body]
+        return (body[i:i + size] for i in range(0, len(body), size))
+
+    def response(self, asset, request_headers):
+        """(status, headers, body) for a request to the asset"""
+        encodings = accepted_encodings(request_headers.get('Accept-Encoding'))
+        encoding = next((e for e in ('br', 'gzip') if e in encodings and e in asset.variants), None)
+        # Each variant is a different representation and gets its own ETag
+        etag = asset.etag if encoding is None else f'{asset.etag[:-1]}-{encoding}"'
+        headers = {
+            'ETag': etag,
+            'Cache-Control': asset.cache_control,
+            'Content-Type': asset.content_type,
+        }
+        if asset.variants:
+            headers['Vary'] = 'Accept-Encoding'
+
+        if_none_match = request_headers.get('If-None-Match')
+        if if_none_match and (if_none_match.strip() == '*' or etag in
+                              (tag.strip() for tag in if_none_match.split(','))):
+            return 304, headers, b''
+
+        body = asset.body if encoding is None else asset.variants[encoding]
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        headers['Content-Length'] = str(len(body))
+        return 200, headers, body
@@ -0,0 +1,98 @@
+import time
+from collections import Counter, defaultdict
+
+from redis import RedisError
+
+from counters import WriteBehind
+
+# Step -> (bucket size, seconds covered by one Redis hash of buckets)
+STEPS = {
+    'minute': (60, 3600),
+    'hour': (3600, 86400),
+}
+# Operations on the main counter, then on named counters (all names together)
+OPERATIONS = ('increment', 'decrement', 'reset', 'named_increment', 'named_decrement', 'named_reset')
+
+
+class ActivityStats(WriteBehind):
+    """Counter activity in minute and hour buckets.
+
+    Operation counts live in one hash per hour (minute buckets) or per day
+    (hour buckets): HINCRBY <prefix>:<step>:<hash start> <bucket>:<operation>.
+    Distinct clients per bucket are a HyperLogLog: PFADD
+    <prefix>:actors:<step>:<bucket>. Both roll up at write time and expire
+    after the retention of their step. Requests only update local tallies;
+    a background thread writes them with one pipeline."""
+    thread_name = 'stats-flusher'
+
+    def __init__(self, redis_getter, prefix, retention, interval=1.0):
+        super().__init__(interval)
+        self.redis = redis_getter
+        self.prefix = prefix
+        # step -> seconds a bucket is kept
+        self.retention = retention
+        self.counts = Counter()
+        self.actors = defaultdict(set)
+
+    def _hash_key(self, step, bucket):
+        span = STEPS[step][1]
+        return f'{self.prefix}:{step}:{bucket - bucket % span}'
+
+    def _actors_key(self, step, bucket):
+        return f'{self.prefix}:actors:{step}:{bucket}'
+
+    def record(self, operation, actor, now=None, count=1):
+        self._ensure_flusher()
+        now = int(now if now is not None else time.time())
+        with self.lock:
+            for step, (size, _) in STEPS.items():
+                bucket = now - now % size
+                self.counts[(step, bucket, operation)] += count
+                if actor:
+                    self.actors[(step, bucket)].add(actor)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                counts, self.counts = self.counts, Counter()
+                actors, self.actors = self.actors, defaultdict(set)
+            if not counts and not actors:
+                return
+            pipe = self.redis().pipeline(transaction=False)
+            expiring = {}
+            for (step, bucket, operation), count in counts.items():
+                key = self._hash_key(step, bucket)
+                pipe.hincrby(key, f'{bucket}:{operation}', count)
+                expiring[key] = bucket - bucket % STEPS[step][1] + STEPS[step][1] + self.retention[step]
+            for (step, bucket), members in actors.items():
+                key = self._actors_key(step, bucket)
+                pipe.pfadd(key, *members)
+                expiring[key] = bucket + STEPS[step][0] + self.retention[step]
+            for key, expire_at in expiring.items():
+                pipe.expireat(key, expire_at)
+            try:
+                pipe.execute()
+            except RedisError:
+                with self.lock:
+                    self.counts.update(counts)
+                    for bucket, members in actors.items():
+                        self.actors[bucket] |= members
+                raise
+
+    def query(self, step, t_from, t_to):
+        """Buckets of step between t_from and t_to, read with one pipeline"""
+        size = STEPS[step][0]
+        buckets = range(t_from - t_from % size, t_to + 1, size)
+        pipe = self.redis().pipeline(transaction=False)
+        for bucket in buckets:
+            pipe.hmget(self._hash_key(step, bucket), [f'{bucket}:{op}' for op in OPERATIONS])
+            pipe.pfcount(self._actors_key(step, bucket))
+        results = pipe.execute()
+
+        points = []
+        for i, bucket in enumerate(buckets):
+            counts = [int(v or 0) for v in results[2 * i]]
+            point = dict(zip(OPERATIONS, counts), t=bucket, actors=results[2 * i + 1])
+            point['net'] = point['increment'] - point['decrement']
+            points.append(point)
+        return points
@@ -0,0 +1,74 @@
+import os
+import queue
+import threading
+import time
+
+from redis import RedisError
+
+
+class ChannelFanout:
+    """One Redis subscription per worker process, fanned out to local listeners.
+
+    Each SSE client gets a queue holding only the latest message: a client
+    that falls behind skips intermediate values instead of piling them up."""
+
+    def __init__(self, redis_getter, channel, poll_timeout=1.0, retry_delay=1.0):
+        self.redis = redis_getter
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self.retry_delay = retry_delay
+        self.listeners = set()
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def _ensure_subscriber(self):
+        # Threads do not survive fork: start one in every worker
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    threading.Thread(target=self._run, name='counter-subscriber', daemon=True).start()
+                    self.pid = os.getpid()
+
+    def _run(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                while True:
+                    # Short polls stay below the socket timeout of the pool
+                    message = pubsub.get_message(timeout=self.poll_timeout)
+                    if message is not None and message['type'] == 'message':
+                        self._dispatch(message['data'])
+            except RedisError:
+                time.sleep(self.retry_delay)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except RedisError:
+                        pass
+
+    def _dispatch(self, data):
+        with self.lock:
+            listeners = list(self.listeners)
+        for listener in listeners:
+            try:
+                listener.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                listener.put_nowait(data)
+            except queue.Full:
+                pass
+
+    def listen(self):
+        self._ensure_subscriber()
+        listener = queue.Queue(maxsize=1)
+        with self.lock:
+            self.listeners.add(listener)
+        return listener
+
+    def unlisten(self, listener):
+        with self.lock:
+            self.listeners.discard(listener)